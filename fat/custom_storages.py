@@ -1,7 +1,19 @@
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from django.conf import settings
+from django.core import signing
+from django.core.files.storage import Storage, FileSystemStorage, get_storage_class
+from django.utils.crypto import constant_time_compare
+from django.utils.http import urlencode
 from storages.backends.s3boto import S3BotoStorage
 
 
+logger = logging.getLogger(__name__)
+
+
 class StaticStorage(S3BotoStorage):
     location = settings.STATICFILES_LOCATION
     bucket_name = settings.STATICFILES_BUCKET_NAME
@@ -10,3 +22,116 @@ class StaticStorage(S3BotoStorage):
 class MediaStorage(S3BotoStorage):
     location = settings.MEDIAFILES_LOCATION
     bucket_name = settings.MEDIAFILES_BUCKET_NAME
+
+
+_upload_pool = None
+
+
+def get_upload_pool():
+    global _upload_pool
+    if _upload_pool is None:
+        _upload_pool = ThreadPoolExecutor(max_workers=settings.MEDIA_SPOOL_WORKERS)
+    return _upload_pool
+
+
+class SpoolingMediaStorage(Storage):
+    """
+    Storage that writes files to a local spool directory and uploads them
+    to `remote` from a background thread pool, so saving doesn't wait on
+    S3.
+
+    Files are read and linked from the spool until their upload succeeds,
+    then from the remote storage. Spool URLs are signed, so they can be
+    loaded without credentials, and the instance that doesn't hold a file
+    redirects them to the remote storage. Uploads are retried with
+    exponential backoff. Files whose uploads keep failing, or whose
+    process exited before uploading them, stay spooled until the
+    `flush_media_spool` command, run from cron, uploads them. Names get a
+    random suffix, so they are unique in the remote storage without
+    asking it.
+    """
+
+    def __init__(self, remote=None, spool_root=None, spool_url=None, retries=None, backoff=None):
+        self.remote = remote or get_storage_class(settings.MEDIA_REMOTE_STORAGE)()
+        self.spool = FileSystemStorage(
+            location=spool_root or settings.MEDIA_SPOOL_ROOT,
+            base_url=spool_url or settings.MEDIA_SPOOL_URL)
+        self.retries = settings.MEDIA_SPOOL_RETRIES if retries is None else retries
+        self.backoff = settings.MEDIA_SPOOL_BACKOFF if backoff is None else backoff
+
+    def is_spooled(self, name):
+        return self.spool.exists(name)
+
+    def signature(self, name):
+        return signing.Signer(salt='fat.custom_storages.spool').signature(name)
+
+    def check_signature(self, name, signature):
+        return constant_time_compare(self.signature(name), signature)
+
+    def spooled_names(self):
+        for (root, dirs, files) in os.walk(self.spool.location):
+            for filename in files:
+                path = os.path.join(root, filename)
+                yield os.path.relpath(path, self.spool.location).replace(os.sep, '/')
+
+    def upload(self, name):
+        """
+        Upload the spooled file `name` to the remote storage and drop it
+        from the spool. Returns False when every attempt failed, or when
+        the remote storage saved it under another name.
+        """
+        for attempt in range(self.retries + 1):
+            if not self.is_spooled(name):
+                return True
+            try:
+                with self.spool.open(name, 'rb') as content:
+                    remote_name = self.remote.save(name, content)
+                if remote_name != name:
+                    # Saved files are linked by their spool name.
+                    self.remote.delete(remote_name)
+                    logger.error('Remote storage renamed %s to %s, leaving it spooled', name, remote_name)
+                    return False
+            except Exception:
+                if attempt == self.retries:
+                    logger.exception('Could not upload %s, leaving it spooled', name)
+                    return False
+                logger.warning('Upload of %s failed, retrying', name, exc_info=True)
+                time.sleep(self.backoff * 2 ** attempt)
+            else:
+                self.spool.delete(name)
+                return True
+
+    def _open(self, name, mode='rb'):
+        if self.is_spooled(name):
+            return self.spool.open(name, mode)
+        return self.remote.open(name, mode)
+
+    def _save(self, name, content):
+        name = self.spool.save(name, content)
+        get_upload_pool().submit(self.upload, name)
+        return name
+
+    def get_available_name(self, name, max_length=None):
+        (dir_name, file_name) = os.path.split(name)
+        (file_root, file_ext) = os.path.splitext(file_name)
+        suffix = '_' + uuid.uuid4().hex
+        if max_length is not None:
+            file_root = file_root[:max(max_length - len(name) + len(file_root) - len(suffix), 0)]
+        return os.path.join(dir_name, file_root + suffix + file_ext).replace(os.sep, '/')
+
+    def delete(self, name):
+        self.spool.delete(name)
+        self.remote.delete(name)
+
+    def exists(self, name):
+        return self.is_spooled(name) or self.remote.exists(name)
+
+    def size(self, name):
+        if self.is_spooled(name):
+            return self.spool.size(name)
+        return self.remote.size(name)
+
+    def url(self, name):
+        if self.is_spooled(name):
+            return '{}?{}'.format(self.spool.url(name), urlencode({'signature': self.signature(name)}))
+        return self.remote.url(name)
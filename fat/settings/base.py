@@ -229,9 +229,25 @@ STATICFILES_BUCKET_NAME = AWS_STORAGE_BUCKET_NAME
 
 MEDIAFILES_LOCATION = 'media'
 MEDIA_URL = 'https://%s/%s/' % (AWS_S3_CUSTOM_DOMAIN, MEDIAFILES_LOCATION)
-DEFAULT_FILE_STORAGE = 'fat.custom_storages.MediaStorage'
+DEFAULT_FILE_STORAGE = 'fat.custom_storages.SpoolingMediaStorage'
 MEDIAFILES_BUCKET_NAME = AWS_STORAGE_BUCKET_NAME
 
+# Media is written to a local spool and uploaded to MEDIA_REMOTE_STORAGE by
+# a background thread pool. Spooled files are served under MEDIA_SPOOL_URL
+# with signed URLs by the instance that holds them; other instances redirect
+# to the remote storage. Outside DEBUG the spool lives outside the
+# application directory, which deploys replace.
+MEDIA_REMOTE_STORAGE = os.getenv('MEDIA_REMOTE_STORAGE', 'fat.custom_storages.MediaStorage')
+MEDIA_SPOOL_ROOT = os.getenv('MEDIA_SPOOL_ROOT',
+    os.path.join(REPOSITORY_ROOT, 'spool') if DEBUG else '/var/spool/fat')
+MEDIA_SPOOL_URL = '/spool/'
+MEDIA_SPOOL_WORKERS = int(os.getenv('MEDIA_SPOOL_WORKERS', 4))
+MEDIA_SPOOL_RETRIES = int(os.getenv('MEDIA_SPOOL_RETRIES', 5))
+MEDIA_SPOOL_BACKOFF = float(os.getenv('MEDIA_SPOOL_BACKOFF', 1))
+# sorl-thumbnail finds thumbnails by name, which the spool would make
+# unique, so thumbnails go straight to the remote storage.
+THUMBNAIL_STORAGE = MEDIA_REMOTE_STORAGE
+
 CORS_ORIGIN_WHITELIST = ()
 CSRF_TRUSTED_ORIGINS = ()
 CORS_ORIGIN_ALLOW_ALL = True
@@ -254,8 +270,103 @@ REST_FRAMEWORK = {
 }
 
 
+REDIS_URL = os.getenv('REDIS_URL')
+
+# Django's cache, shared in Redis when REDIS_URL is set. Without it nothing
+# is cached, since a per-process cache would keep serving entries that
+# writes in other processes invalidated. Redis errors are ignored and read
+# as misses. Bump CACHE_VERSION to drop every cached entry on deploy.
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'fat',
+            'VERSION': int(os.getenv('CACHE_VERSION', 1)),
+            'OPTIONS': {
+                'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+                'IGNORE_EXCEPTIONS': True,
+            },
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+        },
+    }
+# Lifetime of cached API list responses, which writes invalidate by
+# bumping their namespace's version.
+VIEW_CACHE_TIMEOUT = int(os.getenv('VIEW_CACHE_TIMEOUT', 60 * 15))
+
+# Bloom filter over the ids of every selected and discarded image, kept
+# in Redis. Without REDIS_URL every triage check goes to the database.
+SEEN_INDEX_KEY = os.getenv('SEEN_INDEX_KEY', 'fat:seen-images')
+SEEN_INDEX_BITS = int(os.getenv('SEEN_INDEX_BITS', 2 ** 24))
+SEEN_INDEX_HASHES = int(os.getenv('SEEN_INDEX_HASHES', 7))
+
+# 'immediate' deletes the images orphaned by a deleted search right away,
+# 'deferred' leaves them to the periodic sweep_orphan_images command.
+SEARCH_ORPHAN_CLEANUP = os.getenv('SEARCH_ORPHAN_CLEANUP', 'immediate')
+
+
 FLICKR_API_KEY = os.getenv('FLICKR_API_KEY')
 FLICKR_API_SECRET = os.getenv('FLICKR_API_SECRET')
+FLICKR_API_URL = os.getenv('FLICKR_API_URL', 'https://api.flickr.com/services/rest/')
+# Base URL of a photo, without size suffix and extension.
+FLICKR_IMAGE_URL = os.getenv('FLICKR_IMAGE_URL', 'https://farm{farm}.staticflickr.com/{server}/{id}_{secret}')
+FLICKR_CONNECT_TIMEOUT = float(os.getenv('FLICKR_CONNECT_TIMEOUT', 3.05))
+FLICKR_READ_TIMEOUT = float(os.getenv('FLICKR_READ_TIMEOUT', 10))
+FLICKR_MAX_RETRIES = int(os.getenv('FLICKR_MAX_RETRIES', 3))
+FLICKR_RETRY_BACKOFF = float(os.getenv('FLICKR_RETRY_BACKOFF', 0.5))
+FLICKR_POOL_SIZE = int(os.getenv('FLICKR_POOL_SIZE', 20))
+# Flickr pages fetched concurrently when a page holds too few untriaged
+# photos, and the most pages a single request may prefetch.
+FLICKR_PREFETCH_PAGES = int(os.getenv('FLICKR_PREFETCH_PAGES', 4))
+FLICKR_PREFETCH_MAX_PAGES = int(os.getenv('FLICKR_PREFETCH_MAX_PAGES', 8))
+
+# Serve triage candidates from photos staged by the harvest_searches
+# command instead of calling Flickr in the request.
+FLICKR_HARVEST_ENABLED = os.getenv('FLICKR_HARVEST_ENABLED', 'NO').lower() in ('on', 'true', 'y', 'yes')
+HARVEST_QUEUE_KEY = os.getenv('HARVEST_QUEUE_KEY', 'fat:harvest-queue')
+HARVEST_CONCURRENCY = int(os.getenv('HARVEST_CONCURRENCY', 4))
+HARVEST_PER_PAGE = int(os.getenv('HARVEST_PER_PAGE', 500))
+# Seconds `harvest_searches --watch` waits for a queued search before it
+# recycles its database connection and waits again.
+HARVEST_POLL_TIMEOUT = int(os.getenv('HARVEST_POLL_TIMEOUT', 30))
+
+# Cache for flickr.photos.search responses: 'redis', 'locmem' or 'none'.
+# The redis backend falls back to locmem when REDIS_URL is not set.
+FLICKR_CACHE_BACKEND = os.getenv('FLICKR_CACHE_BACKEND', 'redis')
+FLICKR_CACHE_PREFIX = os.getenv('FLICKR_CACHE_PREFIX', 'fat:flickr-search')
+FLICKR_CACHE_TIMEOUT = int(os.getenv('FLICKR_CACHE_TIMEOUT', 60 * 10))
+FLICKR_CACHE_MAX_ENTRIES = int(os.getenv('FLICKR_CACHE_MAX_ENTRIES', 512))
+
+# Lifetime of the tag, license and marked object facet counts in Django's
+# cache. Triage and annotation writes invalidate them; the timeout bounds
+# the staleness of writes outside those paths, like orphan sweeps.
+FACETS_CACHE_TIMEOUT = int(os.getenv('FACETS_CACHE_TIMEOUT', 60 * 5))
+FACETS_TOP_TAGS = int(os.getenv('FACETS_TOP_TAGS', 20))
+
+# Local mirror of Flickr photos, served under IMAGE_MIRROR_URL (where
+# flickr.urls is mounted) to the admin and the API instead of Flickr URLs.
+# API responses resolve a relative IMAGE_MIRROR_URL against the request's
+# host; set an absolute one when the API sits behind another origin.
+IMAGE_MIRROR_ENABLED = os.getenv('IMAGE_MIRROR_ENABLED', 'YES').lower() in ('on', 'true', 'y', 'yes')
+IMAGE_MIRROR_URL = os.getenv('IMAGE_MIRROR_URL', '/flickr/mirror/')
+IMAGE_MIRROR_ROOT = os.getenv('IMAGE_MIRROR_ROOT', os.path.join(REPOSITORY_ROOT, 'mirror'))
+IMAGE_MIRROR_MAX_BYTES = int(os.getenv('IMAGE_MIRROR_MAX_BYTES', 2 * 1024 ** 3))
+IMAGE_MIRROR_THUMBNAIL_GEOMETRY = '150x150'
+
+# Sharded dataset export: the process pool size of the export_shards command.
+EXPORT_SHARD_WORKERS = int(os.getenv('EXPORT_SHARD_WORKERS', 4))
+
+# Most annotations a batch request may create. Each carries a decoded and
+# re-encoded paint image, so larger batches are rejected with a 400.
+ANNOTATION_BATCH_MAX_SIZE = int(os.getenv('ANNOTATION_BATCH_MAX_SIZE', 100))
+# Paint images with more pixels than this are stored as sent, rather than
+# decoded in full to be palettized.
+MASK_COMPACT_MAX_PIXELS = int(os.getenv('MASK_COMPACT_MAX_PIXELS', 3840 * 2160))
 FORCE_LOWERCASE_TAGS = True
 FLICKR_LICENSES = (
   (0, _('All Rights Reserved')),
@@ -14,6 +14,7 @@ router.register(r'search', flickr_api.SearchViewSet)
 router.register(r'images', flickr_api.ImageViewSet)
 router.register(r'annotations', flickr_api.AnnotationViewSet)
 router.register(r'semantic-checks', flickr_api.SemanticCheckViewSet)
+router.register(r'tags', flickr_api.TagViewSet)
 
 urlpatterns = [
     url(r'^api/v1/', include(router.urls)),
@@ -24,8 +25,12 @@ urlpatterns += [
     url(r'^auth/', include('rest_auth.urls')),
     url(r'^api/v1/schema/$', schema_view),
     url(r'^api/v1/flickr', flickr_api.flickr, name='flickr'),
+    url(r'^api/v1/facets$', flickr_api.FacetsView.as_view(), name='facets'),
     url(r'^$', flickr_api.HomeView.as_view()),
     url(r'^flickr/', include('flickr.urls')),
+    # Media waiting in the upload spool, see SpoolingMediaStorage.
+    url(r'^{}(?P<path>.*)$'.format(settings.MEDIA_SPOOL_URL.lstrip('/')), flickr_api.spooled_media,
+        name='spooled-media'),
 ]
 
 if settings.DEBUG == True:
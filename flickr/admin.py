@@ -1,27 +1,64 @@
 from django import forms
+from django.conf import settings
+from django.core.cache import cache
 from django.contrib import admin
 from django.contrib.auth.models import Group, Permission
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.forms import ReadOnlyPasswordHashField
 from django.template.loader import render_to_string
 from django.shortcuts import redirect
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.utils.translation import ugettext as _
 from sorl.thumbnail.admin import AdminImageMixin
+from .cache import invalidate_facets, namespace_key
 from .models import (
     Search, Image, DiscardedImage, Annotation,
     SemanticCheck, AnnotationSemanticCheck,
-    MarkedObject,
+    MarkedObject, Tag, ImageTag,
 )
 
 
+class TagListFilter(admin.SimpleListFilter):
+    """
+    Facet images by their most used tags, counted with one grouped query
+    over the tag index and cached until the next triage.
+    """
+    title = _('Tag')
+    parameter_name = 'tag'
+    link = 'image_tags'
+
+    def lookups(self, request, model_admin):
+        key = namespace_key('facets', 'admin-tags', self.link, settings.FACETS_TOP_TAGS)
+        tags = cache.get(key)
+        if tags is None:
+            tags = list(Tag.objects
+                .annotate(count=Count(self.link))
+                .filter(count__gt=0)
+                .order_by('-count', 'name')
+                .values_list('name', 'count')[:settings.FACETS_TOP_TAGS])
+            cache.set(key, tags, settings.FACETS_CACHE_TIMEOUT)
+        return [(name, '{} ({})'.format(name, count)) for (name, count) in tags]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(image_tags__tag__name=self.value())
+        return queryset
+
+
+class DiscardedTagListFilter(TagListFilter):
+    link = 'discarded_image_tags'
+
+
 @admin.register(DiscardedImage)
 class DiscardedImageAdmin(AdminImageMixin, admin.ModelAdmin):
     list_display = ('image_tag', 'id', 'secret', 'license', 'tags')
     list_display_links = ('image_tag', 'id')
+    list_filter = (DiscardedTagListFilter,)
     readonly_fields = ('image_tag', 'ispublic', 'isfriend', 'isfamily')
 
     def image_tag(self, obj):
-        return '<img height="100" src="{}" />'.format(obj.get_flickr_url)
+        return '<img height="100" src="{}" />'.format(obj.get_cached_thumbnail)
     image_tag.short_description = _('Original image')
     image_tag.allow_tags = True
 
@@ -30,12 +67,12 @@ class DiscardedImageAdmin(AdminImageMixin, admin.ModelAdmin):
 class ImageAdmin(AdminImageMixin, admin.ModelAdmin):
     list_display = ('image_tag', 'id', 'secret', 'license', 'tags')
     list_display_links = ('image_tag', 'id')
-    list_filter = ('search', 'license',
+    list_filter = ('search', TagListFilter, 'license',
         'ispublic', 'isfriend', 'isfamily')
     readonly_fields = ('image_tag', 'ispublic', 'isfriend', 'isfamily',)
 
     def image_tag(self, obj):
-        return '<img src="{}" height="100" />'.format(obj.get_flickr_url)
+        return '<img src="{}" height="100" />'.format(obj.get_cached_thumbnail)
     image_tag.short_description = _('Original image')
     image_tag.allow_tags = True
 
@@ -44,15 +81,22 @@ class ImageAdmin(AdminImageMixin, admin.ModelAdmin):
 class SearchAdmin(admin.ModelAdmin):
     list_display = (
         'tags',
-        'image_count',)
+        'image_count',
+        'discarded_count',
+        'remaining_count',)
     list_display_links = ('tags',)
     list_filter = ('tag_mode', 'user_id', 'created_at', 'updated_at',)
     filter_horizontal = ('images',)
-    readonly_fields = ('licenses',)
+    readonly_fields = ('licenses', 'selected_count', 'discarded_count', 'flickr_total',)
 
     def image_count(self, obj):
-        return obj.images.count()
+        return obj.selected_count
     image_count.short_description = _('Image count')
+    image_count.admin_order_field = 'selected_count'
+
+    def remaining_count(self, obj):
+        return obj.remaining_count
+    remaining_count.short_description = _('Remaining')
 
 
 class AnnotationSemanticCheckInline(admin.TabularInline):
@@ -62,6 +106,7 @@ class AnnotationSemanticCheckInline(admin.TabularInline):
 
 def make_approved(modeladmin, request, queryset):
     queryset.update(is_approved=True)
+    invalidate_facets()
 make_approved.short_description = "Mark selected annotations as approved"
 
 @admin.register(Annotation)
@@ -79,7 +124,7 @@ class AnnotationAdmin(AdminImageMixin, admin.ModelAdmin):
                 <img height="100" src="{}" />
                 <img height="100" src="{}" style="position:absolute;left:0;top:0;"/>
             </div>
-        '''.format(obj.image.get_flickr_url, obj.paint_image.url)
+        '''.format(obj.image.get_cached_url, obj.paint_image.url)
     preview_tag.short_description = _('Composite')
     preview_tag.allow_tags = True
 
@@ -100,6 +145,24 @@ class AnnotationAdmin(AdminImageMixin, admin.ModelAdmin):
     paint_image_tag.allow_tags = True
 
 
+@admin.register(Tag)
+class TagAdmin(admin.ModelAdmin):
+    list_display = ('name', 'image_count')
+    search_fields = ('^name',)
+
+    def get_queryset(self, request):
+        # A correlated subquery, so only the tags of the page are counted.
+        # Sorting by it would count every tag, so the column isn't sortable.
+        image_count = ImageTag.objects.filter(tag=OuterRef('pk')).order_by() \
+            .values('tag').annotate(count=Count('id')).values('count')
+        return super().get_queryset(request).annotate(
+            image_count=Coalesce(Subquery(image_count, output_field=IntegerField()), 0))
+
+    def image_count(self, obj):
+        return obj.image_count
+    image_count.short_description = _('Image count')
+
+
 @admin.register(SemanticCheck)
 class SemanticCheckAdmin(admin.ModelAdmin):
     list_display = ('label',)
@@ -0,0 +1,150 @@
+import os
+import uuid
+from django.db import connections, transaction
+from .cache import invalidate_facets
+from .models import Annotation, AnnotationSemanticCheck, MarkedObject
+
+
+MARKED_OBJECT_FIELDS = ('object_type', 'gender', 'age_group', 'x', 'y', 'width', 'height')
+
+
+def save_marked_objects(annotation, marked_objects_data):
+    """
+    Make `annotation`'s marked objects match `marked_objects_data`.
+
+    Items are matched to existing objects by `uuid`: changed objects are
+    updated, new ones are bulk created and linked with a single through
+    table insert, and objects missing from the data are deleted in bulk.
+    """
+    existing = {marked_object.uuid: marked_object
+        for marked_object in annotation.marked_objects.all()}
+
+    kept = set()
+    new_objects = []
+    for data in marked_objects_data:
+        marked_object = existing.get(data.get('uuid'))
+        if marked_object is None:
+            new_objects.append(MarkedObject(
+                uuid=data.get('uuid') or uuid.uuid4(),
+                **{field: data.get(field) for field in MARKED_OBJECT_FIELDS}))
+            continue
+        kept.add(marked_object.uuid)
+        changes = {field: data.get(field) for field in MARKED_OBJECT_FIELDS
+            if getattr(marked_object, field) != data.get(field)}
+        if changes:
+            MarkedObject.objects.filter(pk=marked_object.pk).update(**changes)
+
+    removed_ids = [marked_object.pk for (object_uuid, marked_object) in existing.items()
+        if object_uuid not in kept]
+    if removed_ids:
+        MarkedObject.objects.filter(pk__in=removed_ids).delete()
+
+    _link_marked_objects([(annotation, new_objects)])
+
+
+def save_semantic_checks(annotation, semantic_checks_data):
+    """
+    Make `annotation`'s semantic check values match `semantic_checks_data`,
+    upserting on the (annotation, semantic_check) pair.
+    """
+    existing = {row.semantic_check_id: row
+        for row in AnnotationSemanticCheck.objects.filter(annotation=annotation)}
+
+    new_rows = []
+    for data in semantic_checks_data:
+        row = existing.pop(data['semantic_check'], None)
+        if row is None:
+            new_rows.append(AnnotationSemanticCheck(
+                annotation=annotation, semantic_check_id=data['semantic_check'], value=data['value']))
+        elif row.value != data['value']:
+            AnnotationSemanticCheck.objects.filter(pk=row.pk).update(value=data['value'])
+
+    if existing:
+        AnnotationSemanticCheck.objects.filter(pk__in=[row.pk for row in existing.values()]).delete()
+    AnnotationSemanticCheck.objects.bulk_create(new_rows)
+
+
+def update_annotation(annotation, marked_objects_data=None, semantic_checks_data=None):
+    """
+    Apply validated marked object and semantic check data to `annotation`
+    in one transaction. `None` leaves that relation untouched.
+    """
+    with transaction.atomic():
+        if semantic_checks_data is not None:
+            save_semantic_checks(annotation, semantic_checks_data)
+        if marked_objects_data is not None:
+            save_marked_objects(annotation, marked_objects_data)
+        annotation.save(update_fields=['updated_at'])
+
+
+def replace_paint_image(annotation, paint_image):
+    """
+    Store the uploaded `paint_image` file for `annotation`, streaming it to
+    the media storage, and delete the file it replaces once committed.
+    """
+    previous_name = annotation.paint_image.name
+    extension = os.path.splitext(paint_image.name)[1].lower() or '.png'
+    with transaction.atomic():
+        annotation.paint_image.save(
+            '{}{}'.format(str(uuid.uuid4())[:12], extension), paint_image, save=False)
+        annotation.save(update_fields=['paint_image', 'updated_at'])
+        if previous_name:
+            storage = annotation.paint_image.storage
+            transaction.on_commit(lambda: storage.delete(previous_name))
+
+
+def _link_marked_objects(marked_objects_by_annotation):
+    """
+    Bulk create marked objects and link them to their annotations, given
+    a list of `(annotation, [MarkedObject, ...])` pairs.
+    """
+    new_objects = [marked_object for (annotation, marked_objects) in marked_objects_by_annotation
+        for marked_object in marked_objects]
+    if not new_objects:
+        return
+    MarkedObject.objects.bulk_create(new_objects)
+    # Not every backend returns primary keys from bulk_create.
+    ids_by_uuid = dict(MarkedObject.objects.filter(
+        uuid__in=[marked_object.uuid for marked_object in new_objects]).values_list('uuid', 'pk'))
+    AnnotationMarkedObject = Annotation.marked_objects.through
+    AnnotationMarkedObject.objects.bulk_create([
+        AnnotationMarkedObject(annotation_id=annotation.pk,
+            markedobject_id=ids_by_uuid[marked_object.uuid])
+        for (annotation, marked_objects) in marked_objects_by_annotation
+        for marked_object in marked_objects])
+
+
+def create_annotations(items):
+    """
+    Create annotations from validated batch items in one transaction and
+    return them in order.
+
+    Annotations are bulk inserted where the database returns primary
+    keys, and saved one by one elsewhere. Their marked objects, through
+    table rows and semantic check values take one bulk insert each.
+    """
+    with transaction.atomic():
+        annotations = [Annotation(image_id=item['image'], paint_image=item.get('paint_image', ''))
+            for item in items]
+        if connections[Annotation.objects.db].features.can_return_ids_from_bulk_insert:
+            Annotation.objects.bulk_create(annotations)
+        else:
+            for annotation in annotations:
+                annotation.save()
+
+        _link_marked_objects([
+            (annotation, [MarkedObject(
+                uuid=data.get('uuid') or uuid.uuid4(),
+                **{field: data.get(field) for field in MARKED_OBJECT_FIELDS})
+                for data in item.get('marked_objects', [])])
+            for (annotation, item) in zip(annotations, items)])
+
+        AnnotationSemanticCheck.objects.bulk_create([
+            AnnotationSemanticCheck(annotation=annotation,
+                semantic_check_id=data['semantic_check'], value=data['value'])
+            for (annotation, item) in zip(annotations, items)
+            for data in item.get('semantic_checks', [])])
+        # Bulk inserts send no post_save.
+        invalidate_facets()
+
+    return annotations
@@ -0,0 +1,231 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from redis.exceptions import RedisError
+from .connections import get_redis
+
+
+logger = logging.getLogger(__name__)
+
+
+def make_search_key(tags, tag_mode, licenses, page, per_page):
+    """
+    Cache key for one page of `flickr.photos.search` results.
+    """
+    if isinstance(licenses, (list, tuple, set)):
+        licenses = ','.join(sorted(str(license) for license in licenses))
+    raw = json.dumps([tags, tag_mode, licenses, int(page), int(per_page)])
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+class ResponseCache(metaclass=ABCMeta):
+    """
+    Size-bounded LRU cache of decoded Flickr responses with a TTL.
+    """
+
+    def __init__(self, timeout=None, max_entries=None):
+        self.timeout = timeout or settings.FLICKR_CACHE_TIMEOUT
+        self.max_entries = max_entries or settings.FLICKR_CACHE_MAX_ENTRIES
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self._get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': self.size()}
+
+    @abstractmethod
+    def _get(self, key):
+        pass
+
+    @abstractmethod
+    def set(self, key, value):
+        pass
+
+    @abstractmethod
+    def size(self):
+        pass
+
+    @abstractmethod
+    def clear(self):
+        pass
+
+
+class LocMemResponseCache(ResponseCache):
+
+    def __init__(self, *args, **kwargs):
+        super(LocMemResponseCache, self).__init__(*args, **kwargs)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            (expires_at, value) = entry
+            if expires_at < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.time() + self.timeout, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def size(self):
+        return len(self.entries)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class RedisResponseCache(ResponseCache):
+    """
+    Cache shared by every worker.
+
+    Entries expire through Redis TTLs, and a sorted set scored by last
+    access time evicts the least recently used entries beyond
+    `max_entries`. Hit and miss counters are kept in Redis as well.
+    Redis errors are logged and treated as misses.
+    """
+
+    def __init__(self, connection, prefix=None, *args, **kwargs):
+        super(RedisResponseCache, self).__init__(*args, **kwargs)
+        self.connection = connection
+        self.prefix = prefix or settings.FLICKR_CACHE_PREFIX
+        self.lru_key = '{}:lru'.format(self.prefix)
+
+    def _entry_key(self, key):
+        return '{}:{}'.format(self.prefix, key)
+
+    def get(self, key):
+        value = super(RedisResponseCache, self).get(key)
+        try:
+            self.connection.incr('{}:{}'.format(self.prefix, 'misses' if value is None else 'hits'))
+        except RedisError:
+            pass
+        return value
+
+    def _get(self, key):
+        try:
+            raw = self.connection.get(self._entry_key(key))
+            if raw is None:
+                return None
+            self.connection.zadd(self.lru_key, time.time(), key)
+        except RedisError:
+            logger.exception('Flickr response cache lookup failed')
+            return None
+        return json.loads(raw.decode('utf-8'))
+
+    def set(self, key, value):
+        try:
+            pipe = self.connection.pipeline(transaction=False)
+            pipe.setex(self._entry_key(key), self.timeout, json.dumps(value))
+            pipe.zadd(self.lru_key, time.time(), key)
+            pipe.zcard(self.lru_key)
+            size = pipe.execute()[-1]
+            if size > self.max_entries:
+                stale = self.connection.zrange(self.lru_key, 0, size - self.max_entries - 1)
+                if stale:
+                    pipe = self.connection.pipeline(transaction=False)
+                    pipe.delete(*[self._entry_key(k.decode('utf-8')) for k in stale])
+                    pipe.zrem(self.lru_key, *stale)
+                    pipe.execute()
+        except RedisError:
+            logger.exception('Flickr response cache update failed')
+
+    def stats(self):
+        try:
+            (hits, misses) = self.connection.mget(
+                '{}:hits'.format(self.prefix), '{}:misses'.format(self.prefix))
+            size = self.size()
+        except RedisError:
+            return super(RedisResponseCache, self).stats()
+        return {'hits': int(hits or 0), 'misses': int(misses or 0), 'size': size}
+
+    def size(self):
+        return self.connection.zcard(self.lru_key)
+
+    def clear(self):
+        keys = self.connection.zrange(self.lru_key, 0, -1)
+        pipe = self.connection.pipeline(transaction=False)
+        if keys:
+            pipe.delete(*[self._entry_key(k.decode('utf-8')) for k in keys])
+        pipe.delete(self.lru_key, '{}:hits'.format(self.prefix), '{}:misses'.format(self.prefix))
+        pipe.execute()
+
+
+_response_cache = None
+
+
+def get_response_cache():
+    """
+    Return the configured Flickr response cache, or None when disabled.
+    """
+    global _response_cache
+    if _response_cache is None:
+        backend = settings.FLICKR_CACHE_BACKEND
+        if backend == 'redis' and get_redis() is not None:
+            _response_cache = RedisResponseCache(get_redis())
+        elif backend in ('redis', 'locmem'):
+            _response_cache = LocMemResponseCache()
+    return _response_cache
+
+
+def _namespace_version_key(namespace):
+    return 'version:{}'.format(namespace)
+
+
+def namespace_key(namespace, *parts):
+    """
+    Key of a Django cache entry in `namespace`, at the namespace's current
+    version. Versions start at the current time in milliseconds, so a
+    version lost to eviction is never reused.
+    """
+    version_key = _namespace_version_key(namespace)
+    version = cache.get(version_key)
+    if version is None:
+        cache.add(version_key, int(time.time() * 1000), None)
+        version = cache.get(version_key) or int(time.time() * 1000)
+    raw = json.dumps([str(part) for part in parts])
+    return '{}:{}:{}'.format(namespace, version, hashlib.sha1(raw.encode('utf-8')).hexdigest())
+
+
+def invalidate_namespace(namespace):
+    """
+    Bump the version of `namespace` once the current transaction commits,
+    so the entries cached in it are never read again.
+    """
+    def bump():
+        version_key = _namespace_version_key(namespace)
+        try:
+            cache.incr(version_key)
+        except ValueError:
+            cache.set(version_key, int(time.time() * 1000), None)
+    transaction.on_commit(bump)
+
+
+def invalidate_facets():
+    """
+    Invalidate the cached facet counts once the current transaction commits.
+    """
+    invalidate_namespace('facets')
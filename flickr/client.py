@@ -0,0 +1,119 @@
+import logging
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+from .cache import get_response_cache, make_search_key
+
+
+logger = logging.getLogger(__name__)
+
+
+class FlickrClient(object):
+    """
+    Client for the Flickr REST API.
+
+    Requests go through one `requests.Session` with a bounded keep-alive
+    connection pool, connect and read timeouts, and retries with
+    exponential backoff on connection errors, 429 and 5xx responses.
+    """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, api_url=None, api_key=None, api_secret=None, timeout=None,
+                 pool_size=None, max_retries=None, backoff_factor=None, cache=None):
+        self.api_url = api_url or settings.FLICKR_API_URL
+        self.api_key = api_key or settings.FLICKR_API_KEY
+        self.api_secret = api_secret or settings.FLICKR_API_SECRET
+        self.timeout = timeout or (settings.FLICKR_CONNECT_TIMEOUT, settings.FLICKR_READ_TIMEOUT)
+        self.cache = cache
+
+        retry = Retry(
+            total=settings.FLICKR_MAX_RETRIES if max_retries is None else max_retries,
+            backoff_factor=settings.FLICKR_RETRY_BACKOFF if backoff_factor is None else backoff_factor,
+            status_forcelist=self.RETRY_STATUSES,
+            raise_on_status=False)
+        pool_size = pool_size or settings.FLICKR_POOL_SIZE
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def call(self, method, **params):
+        """
+        Call a Flickr API method and return the decoded response,
+        or None when the request fails or Flickr reports an error.
+        """
+        params.update({
+            'method': method,
+            'api_key': self.api_key,
+            'api_secret': self.api_secret,
+            'format': 'json',
+            'nojsoncallback': 1,
+        })
+        try:
+            response = self.session.get(self.api_url, params=params, timeout=self.timeout)
+            response.raise_for_status()
+            data = response.json()
+        except (requests.RequestException, ValueError):
+            logger.exception('Flickr call to %s failed', method)
+            return None
+        if data.get('stat') != 'ok':
+            logger.warning('Flickr call to %s returned %s', method, data.get('message'))
+            return None
+        return data
+
+    def download(self, url):
+        """
+        Return the content at `url`, such as a photo, or None when the
+        download fails.
+        """
+        try:
+            response = self.session.get(url, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException:
+            logger.exception('Download of %s failed', url)
+            return None
+        return response.content
+
+    def search(self, tags, tag_mode=None, licenses=None, page=1, per_page=500):
+        """
+        Return one page of `flickr.photos.search` results, from the
+        response cache when possible.
+        """
+        # Flickr treats page 0 as page 1, so both share a cache entry.
+        page = max(int(page), 1)
+
+        if self.cache is not None:
+            cache_key = make_search_key(tags, tag_mode, licenses, page, per_page)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        data = self.call('flickr.photos.search',
+            license=licenses,
+            safe_search=3,
+            sort='relevance',
+            media='photos',
+            content_type=7,
+            extras='license,tags',
+            per_page=per_page,
+            page=str(page),
+            tags=tags,
+            tag_mode=tag_mode)
+        if data is not None and self.cache is not None:
+            self.cache.set(cache_key, data)
+        return data
+
+
+_client = None
+
+
+def get_client():
+    """
+    Return the process-wide Flickr client.
+    """
+    global _client
+    if _client is None:
+        _client = FlickrClient(cache=get_response_cache())
+    return _client
@@ -0,0 +1,17 @@
+import redis
+from django.conf import settings
+
+
+_redis = None
+
+
+def get_redis():
+    """
+    Return the shared Redis client, or None when REDIS_URL is not configured.
+    """
+    global _redis
+    if not settings.REDIS_URL:
+        return None
+    if _redis is None:
+        _redis = redis.StrictRedis.from_url(settings.REDIS_URL)
+    return _redis
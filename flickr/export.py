@@ -0,0 +1,211 @@
+import json
+from collections import defaultdict
+from itertools import islice
+from xml.etree import ElementTree
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from .models import Image, Annotation, AnnotationSemanticCheck, MarkedObject, get_flickr_image_base
+
+
+EXPORT_CHUNK_SIZE = 500
+
+ANNOTATION_EXPORT_FIELDS = ('id', 'image_id', 'image__farm', 'image__server', 'image__secret',
+    'paint_image', 'is_approved', 'created_at', 'updated_at')
+MARKED_OBJECT_EXPORT_FIELDS = ('id', 'object_type', 'gender', 'age_group', 'x', 'y', 'width', 'height')
+
+
+def export_queryset(is_approved=None, search=None):
+    """
+    Return the annotations to export, optionally only approved or
+    unapproved ones, or those of images selected by `search`.
+    """
+    annotations = Annotation.objects.all()
+    if is_approved is not None:
+        annotations = annotations.filter(is_approved=is_approved)
+    if search is not None:
+        annotations = annotations.filter(image__search=search)
+    return annotations
+
+
+def _chunks(rows, size):
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def annotation_rows(annotations, chunk_size=EXPORT_CHUNK_SIZE, media_urls=True):
+    """
+    Yield a dict per annotation with its marked objects and semantic
+    check values. `paint_image` is the mask's URL, or its storage name
+    when `media_urls` is false.
+
+    Annotations are read with a server-side cursor, and the relations of
+    each `chunk_size` annotations take one query each, so memory use
+    doesn't grow with the size of the export.
+    """
+    AnnotationMarkedObject = Annotation.marked_objects.through
+    rows = annotations.order_by('pk').values(*ANNOTATION_EXPORT_FIELDS).iterator()
+    for chunk in _chunks(rows, chunk_size):
+        annotation_ids = [row['id'] for row in chunk]
+
+        marked_objects = defaultdict(list)
+        for link in AnnotationMarkedObject.objects \
+                .filter(annotation_id__in=annotation_ids) \
+                .order_by('markedobject_id') \
+                .values('annotation_id', *('markedobject__' + field for field in MARKED_OBJECT_EXPORT_FIELDS)):
+            marked_objects[link['annotation_id']].append({
+                field: link['markedobject__' + field] for field in MARKED_OBJECT_EXPORT_FIELDS})
+
+        semantic_checks = defaultdict(dict)
+        for (annotation_id, label, value) in AnnotationSemanticCheck.objects \
+                .filter(annotation_id__in=annotation_ids) \
+                .order_by('semantic_check_id') \
+                .values_list('annotation_id', 'semantic_check__label', 'value'):
+            semantic_checks[annotation_id][label] = value
+
+        for row in chunk:
+            image_base = get_flickr_image_base(
+                row['image__farm'], row['image__server'], row['image_id'], row['image__secret'])
+            paint_image = row['paint_image'] or None
+            if paint_image and media_urls:
+                paint_image = default_storage.url(paint_image)
+            yield {
+                'id': row['id'],
+                'image': row['image_id'],
+                'image_url': '{}.jpg'.format(image_base),
+                'paint_image': paint_image,
+                'is_approved': row['is_approved'],
+                'created_at': row['created_at'],
+                'updated_at': row['updated_at'],
+                'marked_objects': marked_objects[row['id']],
+                'semantic_checks': semantic_checks[row['id']],
+            }
+
+
+def _choice_label(choices, value):
+    return str(dict(choices)[value]) if value is not None else None
+
+
+def export_jsonl(annotations):
+    """
+    Yield one JSON document per annotation, one per line.
+    """
+    for row in annotation_rows(annotations):
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+
+def _coco_image_id(image_id):
+    return int(image_id) if image_id.isdigit() else image_id
+
+
+def export_coco(annotations):
+    """
+    Yield a COCO object detection document in pieces. Flickr images are
+    the COCO images, and every marked object is a COCO annotation whose
+    category is its object type. Image sizes aren't stored, so `width`
+    and `height` are null.
+    """
+    yield '{"info": %s, "categories": %s, "images": [' % (
+        json.dumps({'description': 'Flickr annotation tool export'}),
+        json.dumps([{'id': object_type + 1, 'name': str(label), 'supercategory': 'body'}
+            for (object_type, label) in MarkedObject.OBJECT_TYPES]))
+
+    images = Image.objects \
+        .filter(pk__in=annotations.values('image_id')) \
+        .order_by('pk') \
+        .values('id', 'farm', 'server', 'secret', 'title', 'owner', 'license') \
+        .iterator()
+    for (index, image) in enumerate(images):
+        yield (',' if index else '') + json.dumps({
+            'id': _coco_image_id(image['id']),
+            'file_name': '{}.jpg'.format(image['id']),
+            'flickr_url': '{}.jpg'.format(get_flickr_image_base(
+                image['farm'], image['server'], image['id'], image['secret'])),
+            'width': None,
+            'height': None,
+            'license': image['license'],
+            'title': image['title'],
+            'owner': image['owner'],
+        })
+
+    yield '], "annotations": ['
+    index = 0
+    for row in annotation_rows(annotations):
+        for marked_object in row['marked_objects']:
+            (x, y, width, height) = (marked_object['x'], marked_object['y'],
+                marked_object['width'], marked_object['height'])
+            yield (',' if index else '') + json.dumps({
+                'id': marked_object['id'],
+                'image_id': _coco_image_id(row['image']),
+                'category_id': marked_object['object_type'] + 1,
+                'bbox': [x, y, width, height],
+                'area': width * height,
+                'iscrowd': 0,
+                'attributes': {
+                    'annotation_id': row['id'],
+                    'is_approved': row['is_approved'],
+                    'gender': _choice_label(MarkedObject.GENDERS, marked_object['gender']),
+                    'age_group': _choice_label(MarkedObject.AGE_GROUPS, marked_object['age_group']),
+                    'semantic_checks': row['semantic_checks'],
+                },
+            })
+            index += 1
+    yield ']}\n'
+
+
+def voc_annotation(row):
+    """
+    Return a Pascal VOC `<annotation>` element for an annotation row.
+    """
+    annotation = ElementTree.Element('annotation')
+    ElementTree.SubElement(annotation, 'folder').text = 'flickr'
+    ElementTree.SubElement(annotation, 'filename').text = '{}.jpg'.format(row['image'])
+    source = ElementTree.SubElement(annotation, 'source')
+    ElementTree.SubElement(source, 'database').text = 'Flickr'
+    ElementTree.SubElement(source, 'annotation').text = str(row['id'])
+    ElementTree.SubElement(source, 'url').text = row['image_url']
+    if row['paint_image']:
+        ElementTree.SubElement(annotation, 'paint_image').text = row['paint_image']
+    ElementTree.SubElement(annotation, 'segmented').text = '1' if row['paint_image'] else '0'
+    ElementTree.SubElement(annotation, 'approved').text = '1' if row['is_approved'] else '0'
+
+    for marked_object in row['marked_objects']:
+        element = ElementTree.SubElement(annotation, 'object')
+        ElementTree.SubElement(element, 'name').text = _choice_label(
+            MarkedObject.OBJECT_TYPES, marked_object['object_type'])
+        for (field, choices) in (('gender', MarkedObject.GENDERS), ('age_group', MarkedObject.AGE_GROUPS)):
+            if marked_object[field] is not None:
+                ElementTree.SubElement(element, field).text = _choice_label(choices, marked_object[field])
+        ElementTree.SubElement(element, 'pose').text = 'Unspecified'
+        ElementTree.SubElement(element, 'truncated').text = '0'
+        ElementTree.SubElement(element, 'difficult').text = '0'
+        bndbox = ElementTree.SubElement(element, 'bndbox')
+        for (tag, value) in (('xmin', marked_object['x']), ('ymin', marked_object['y']),
+                ('xmax', marked_object['x'] + marked_object['width']),
+                ('ymax', marked_object['y'] + marked_object['height'])):
+            ElementTree.SubElement(bndbox, tag).text = str(value)
+
+    for (label, value) in row['semantic_checks'].items():
+        ElementTree.SubElement(annotation, 'semantic_check', label=label).text = str(value)
+    return annotation
+
+
+def export_voc(annotations):
+    """
+    Yield the Pascal VOC annotation of every annotation, wrapped in a
+    single `<dataset>` document.
+    """
+    yield '<?xml version="1.0" encoding="utf-8"?>\n<dataset>\n'
+    for row in annotation_rows(annotations):
+        yield ElementTree.tostring(voc_annotation(row), encoding='unicode') + '\n'
+    yield '</dataset>\n'
+
+
+# Export format: (exporter, content type, file extension).
+EXPORT_FORMATS = {
+    'coco': (export_coco, 'application/json', 'json'),
+    'voc': (export_voc, 'application/xml', 'xml'),
+    'jsonl': (export_jsonl, 'application/x-ndjson', 'jsonl'),
+}
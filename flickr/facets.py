@@ -0,0 +1,90 @@
+from django.conf import settings
+from django.db.models import Count
+from django.core.cache import cache
+from .cache import namespace_key
+from .models import Image, DiscardedImage, Annotation, MarkedObject, Tag, ImageTag, DiscardedImageTag
+
+
+def _histogram(rows, choices):
+    """
+    Return `(value, count)` rows as a list of dicts labelled by `choices`.
+    """
+    labels = {str(value): str(label) for (value, label) in choices}
+    return [{'value': value, 'label': labels.get(str(value)) if value is not None else None, 'count': count}
+        for (value, count) in rows]
+
+
+def _top_tags(links, top):
+    rows = list(links.values_list('tag_id').annotate(count=Count('id')).order_by('-count', 'tag_id')[:top])
+    names = dict(Tag.objects.filter(pk__in=[tag_id for (tag_id, count) in rows]).values_list('id', 'name'))
+    return [{'name': names[tag_id], 'count': count} for (tag_id, count) in rows]
+
+
+def _image_facets(images, links, top):
+    return {
+        'count': images.count(),
+        'tags': _top_tags(links, top),
+        'licenses': _histogram(
+            images.order_by('license').values_list('license').annotate(count=Count('id')),
+            settings.FLICKR_LICENSES),
+    }
+
+
+def compute_facets(search=None, is_approved=None, top=None):
+    """
+    Count the top `top` tags and the licenses of selected and discarded
+    images, and the object types, genders and age groups of marked
+    objects, each with one grouped query.
+
+    `search` narrows every count to the images it selected. Discarded
+    images aren't linked to searches, so their facets are None then.
+    `is_approved` narrows the annotation counts to approved or
+    unapproved annotations.
+    """
+    top = top or settings.FACETS_TOP_TAGS
+    images = Image.objects.all()
+    image_links = ImageTag.objects.all()
+    annotations = Annotation.objects.all()
+    marked_object_lookups = {'annotation__isnull': False}
+    if search is not None:
+        images = images.filter(search=search)
+        image_links = image_links.filter(image__search=search)
+        annotations = annotations.filter(image__search=search)
+        marked_object_lookups['annotation__image__search'] = search
+    if is_approved is not None:
+        annotations = annotations.filter(is_approved=is_approved)
+        marked_object_lookups['annotation__is_approved'] = is_approved
+    # A single filter() call, so every lookup goes through the same join.
+    marked_objects = MarkedObject.objects.filter(**marked_object_lookups)
+
+    return {
+        'selected': _image_facets(images, image_links, top),
+        'discarded': _image_facets(DiscardedImage.objects.all(), DiscardedImageTag.objects.all(), top)
+            if search is None else None,
+        'annotations': {
+            'count': annotations.count(),
+            'marked_objects': marked_objects.count(),
+            'object_types': _histogram(marked_objects.order_by('object_type')
+                .values_list('object_type').annotate(count=Count('id')), MarkedObject.OBJECT_TYPES),
+            'genders': _histogram(marked_objects.order_by('gender')
+                .values_list('gender').annotate(count=Count('id')), MarkedObject.GENDERS),
+            'age_groups': _histogram(marked_objects.order_by('age_group')
+                .values_list('age_group').annotate(count=Count('id')), MarkedObject.AGE_GROUPS),
+        },
+    }
+
+
+def get_facets(search=None, is_approved=None, top=None):
+    """
+    Return `compute_facets`, cached until the next triage or annotation
+    write.
+    """
+    top = top or settings.FACETS_TOP_TAGS
+    # The key holds the version read before computing, so counts computed
+    # while a write commits are stored under the version they predate.
+    key = namespace_key('facets', search.pk if search is not None else None, is_approved, top)
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(search, is_approved, top)
+        cache.set(key, facets, settings.FACETS_CACHE_TIMEOUT)
+    return facets
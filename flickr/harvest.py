@@ -0,0 +1,136 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import transaction
+from redis.exceptions import RedisError
+from .cache import invalidate_namespace
+from .client import get_client
+from .connections import get_redis
+from .models import Search, Image, DiscardedImage, HarvestCursor, Candidate
+
+
+logger = logging.getLogger(__name__)
+
+
+CANDIDATE_FIELDS = ('title', 'owner', 'secret', 'server', 'farm', 'license', 'tags',
+    'ispublic', 'isfriend', 'isfamily')
+
+
+def enqueue_harvest(search):
+    """
+    Queue `search` for the harvester. Returns False when no Redis queue
+    is configured and the search has to be harvested by hand.
+    """
+    connection = get_redis()
+    if connection is None:
+        return False
+    try:
+        connection.lpush(settings.HARVEST_QUEUE_KEY, search.pk)
+    except RedisError:
+        logger.exception('Could not queue search %s for harvesting', search.pk)
+        return False
+    return True
+
+
+def dequeue_harvest(timeout=None):
+    """
+    Wait up to `timeout` seconds, HARVEST_POLL_TIMEOUT by default, for a
+    queued search id and return it, or None on timeout. A timeout of 0
+    waits forever.
+    """
+    if timeout is None:
+        timeout = settings.HARVEST_POLL_TIMEOUT
+    item = get_redis().brpop(settings.HARVEST_QUEUE_KEY, timeout=timeout)
+    if item is None:
+        return None
+    return int(item[1])
+
+
+def _store_candidates(search, photos, first_position):
+    photo_ids = [photo['id'] for photo in photos]
+    existing_ids = set(Candidate.objects.filter(
+        search=search, photo_id__in=photo_ids).values_list('photo_id', flat=True))
+    existing_ids.update(Image.objects.filter(id__in=photo_ids).values_list('id', flat=True))
+    existing_ids.update(DiscardedImage.objects.filter(id__in=photo_ids).values_list('id', flat=True))
+
+    candidates = []
+    for (offset, photo) in enumerate(photos):
+        if photo['id'] in existing_ids:
+            continue
+        existing_ids.add(photo['id'])
+        candidates.append(Candidate(
+            search=search,
+            photo_id=photo['id'],
+            position=first_position + offset,
+            **{field: photo.get(field) for field in CANDIDATE_FIELDS}))
+    Candidate.objects.bulk_create(candidates)
+    return len(candidates)
+
+
+def harvest_search(search, concurrency=None, max_pages=None, client=None):
+    """
+    Walk the Flickr result pages of `search` and stage their untriaged
+    photos as candidates.
+
+    Pages are fetched `concurrency` at a time and stored in order. The
+    search's `HarvestCursor` is advanced after every stored page, so an
+    interrupted harvest resumes where it stopped. Returns the number of
+    candidates stored.
+    """
+    client = client or get_client()
+    concurrency = concurrency or settings.HARVEST_CONCURRENCY
+    (cursor, created) = HarvestCursor.objects.get_or_create(search=search)
+    licenses = ','.join(str(license) for license in search.licenses) or None
+
+    stored = 0
+    fetched = 0
+    while not cursor.is_finished and (max_pages is None or fetched < max_pages):
+        last_page = cursor.next_page + concurrency - 1
+        if cursor.pages is not None:
+            last_page = min(last_page, cursor.pages)
+        if max_pages is not None:
+            last_page = min(last_page, cursor.next_page + max_pages - fetched - 1)
+        pages = range(cursor.next_page, last_page + 1)
+
+        with ThreadPoolExecutor(max_workers=len(pages)) as executor:
+            responses = list(executor.map(lambda page: client.search(
+                search.tags.replace(' ', ''), tag_mode=search.tag_mode, licenses=licenses,
+                page=page, per_page=settings.HARVEST_PER_PAGE), pages))
+
+        for (page, json) in zip(pages, responses):
+            if json is None:
+                logger.warning('Harvest of %s stopped at page %s', search, page)
+                return stored
+            results = json['photos']
+            with transaction.atomic():
+                stored += _store_candidates(
+                    search, results['photo'], (page - 1) * settings.HARVEST_PER_PAGE)
+                cursor.next_page = page + 1
+                cursor.pages = int(results['pages'])
+                cursor.total = int(results['total'])
+                cursor.is_finished = cursor.next_page > cursor.pages or not results['photo']
+                cursor.save()
+                Search.objects.filter(pk=search.pk).update(flickr_total=cursor.total)
+                invalidate_namespace('searches')
+            fetched += 1
+            if cursor.is_finished:
+                break
+    return stored
+
+
+def get_harvested_images(search, cursor, perpage):
+    """
+    Return `(total, photos)` for a page of untriaged harvested candidates,
+    or None when `search` hasn't been harvested yet.
+    """
+    try:
+        harvest_cursor = search.harvest_cursor
+    except HarvestCursor.DoesNotExist:
+        return None
+    if harvest_cursor.total is None:
+        return None
+
+    candidates = search.candidates \
+        .exclude(photo_id__in=Image.objects.values('id')) \
+        .exclude(photo_id__in=DiscardedImage.objects.values('id'))
+    return (harvest_cursor.total, [c.as_photo() for c in candidates[cursor:cursor + perpage]])
@@ -0,0 +1,109 @@
+from django.db import transaction, IntegrityError
+from django.db.models import F
+from .cache import invalidate_facets, invalidate_namespace
+from .models import Search, Image, DiscardedImage, Candidate, ImageTag, DiscardedImageTag, \
+    link_tags, split_tags
+from .seen import get_seen_index
+
+
+SELECTED = 0
+DISCARDED = 1
+
+
+def _bulk_insert(model, objects):
+    """
+    Bulk insert `objects` and return the ones inserted.
+
+    When a concurrent triage inserted some of the same rows first, the
+    batch is inserted again row by row and the rows that clash are
+    skipped, the way `get_or_create` would.
+    """
+    try:
+        with transaction.atomic():
+            return model.objects.bulk_create(objects)
+    except IntegrityError:
+        inserted = []
+        for obj in objects:
+            try:
+                with transaction.atomic():
+                    obj.save(force_insert=True)
+            except IntegrityError:
+                continue
+            inserted.append(obj)
+        return inserted
+
+
+def _insert_missing(model, images_by_id):
+    """
+    Bulk insert the images whose ids are not stored yet. Returns the
+    inserted images and the ids of the images of `images_by_id` that are
+    stored now.
+    """
+    if not images_by_id:
+        return ([], set())
+    existing_ids = set(model.objects.filter(
+        id__in=list(images_by_id)).values_list('id', flat=True))
+    inserted = _bulk_insert(model, [
+        model(**image) for (image_id, image) in images_by_id.items()
+        if image_id not in existing_ids])
+    stored_ids = existing_ids | set(image.pk for image in inserted)
+    skipped_ids = set(images_by_id) - stored_ids
+    if skipped_ids:
+        # Skipped rows were stored by someone else, unless their secret clashed.
+        stored_ids.update(model.objects.filter(
+            id__in=list(skipped_ids)).values_list('id', flat=True))
+    return (inserted, stored_ids)
+
+
+def _index_tags(through, images):
+    return link_tags(through, 'image', {image.pk: split_tags(image.tags) for image in images})
+
+
+def ingest_triaged_images(search, images):
+    """
+    Store a batch of triaged images for `search` in one transaction.
+
+    `images` are validated `ImageSerializer` items whose `state` marks them
+    as selected or discarded. Each table gets a single bulk insert of the
+    images it doesn't have yet, and newly selected images are linked to the
+    search with a single insert into the `Search.images` through table.
+    The tags of new images are added to the tag index, and the search's
+    selected and discarded counters are bumped in the same transaction.
+    """
+    selected = {}
+    discarded = {}
+    for image in images:
+        image = dict(image)
+        state = image.pop('state', SELECTED)
+        if state == SELECTED:
+            selected[image['id']] = image
+        elif state == DISCARDED:
+            discarded[image['id']] = image
+
+    with transaction.atomic():
+        (inserted_selected, selected_ids) = _insert_missing(Image, selected)
+        _index_tags(ImageTag, inserted_selected)
+        (inserted_discarded, discarded_ids) = _insert_missing(DiscardedImage, discarded)
+        _index_tags(DiscardedImageTag, inserted_discarded)
+        discarded_count = len(inserted_discarded)
+
+        selected_count = 0
+        if selected:
+            SearchImage = Search.images.through
+            linked_ids = set(SearchImage.objects.filter(
+                search=search, image_id__in=list(selected)).values_list('image_id', flat=True))
+            selected_count = len(_bulk_insert(SearchImage, [
+                SearchImage(search_id=search.pk, image_id=image_id)
+                for image_id in selected_ids if image_id not in linked_ids]))
+
+        if selected_count or discarded_count:
+            Search.objects.filter(pk=search.pk).update(
+                selected_count=F('selected_count') + selected_count,
+                discarded_count=F('discarded_count') + discarded_count)
+            search.refresh_from_db(fields=['selected_count', 'discarded_count'])
+            invalidate_namespace('searches')
+
+        invalidate_facets()
+        triaged_ids = list(selected_ids) + list(discarded_ids)
+        Candidate.objects.filter(photo_id__in=triaged_ids).delete()
+        transaction.on_commit(lambda: get_seen_index().add(triaged_ids))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from flickr.models import Search, Image, DiscardedImage, ImageTag, DiscardedImageTag, SearchTag, \
+    link_tags, split_tags
+
+
+class Command(BaseCommand):
+    help = 'Adds the tags of stored images and searches to the tag index. Existing links ' \
+        'are kept, so it can be interrupted and run again.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def backfill(self, model, through, field_name, separator, batch_size):
+        """
+        Link the objects of `model` to their tags in primary key order,
+        one transaction per batch.
+        """
+        linked = 0
+        last_pk = None
+        while True:
+            rows = model.objects.order_by('pk').values_list('pk', 'tags')
+            if last_pk is not None:
+                rows = rows.filter(pk__gt=last_pk)
+            rows = list(rows[:batch_size])
+            if not rows:
+                return linked
+            with transaction.atomic():
+                linked += link_tags(through, field_name,
+                    {pk: split_tags(tags, separator) for (pk, tags) in rows})
+            last_pk = rows[-1][0]
+
+    def handle(self, *args, **options):
+        for (model, through, field_name, separator) in (
+                (Image, ImageTag, 'image', None),
+                (DiscardedImage, DiscardedImageTag, 'image', None),
+                (Search, SearchTag, 'search', ',')):
+            linked = self.backfill(model, through, field_name, separator, options['batch_size'])
+            self.stdout.write('{}: {} links added.'.format(model._meta.verbose_name_plural, linked))
+
+        self.stdout.write(self.style.SUCCESS('Tag index backfilled.'))
@@ -0,0 +1,56 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from flickr.models import Image, DiscardedImage
+from flickr.seen import get_seen_index
+from flickr.views import get_filtered_images
+
+
+# One id__in lookup per triaged image table.
+MAX_QUERIES = 2
+
+
+class Command(BaseCommand):
+    help = 'Checks that get_filtered_images issues a constant number of queries per Flickr page.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[25, 100, 500],
+            help='Flickr page sizes to measure.')
+        parser.add_argument('--perpage', type=int, default=25)
+
+    def seed(self, size):
+        """
+        Store every fourth photo as selected and the one after it as
+        discarded, so the index reports probable positives and the id__in
+        lookups have rows to find.
+        """
+        for (model, remainder) in ((Image, 0), (DiscardedImage, 1)):
+            model.objects.bulk_create([
+                model(id='benchmark-{}'.format(i), secret='benchmark-{}'.format(i),
+                    owner='benchmark', server='1234', farm=1)
+                for i in range(size) if i % 4 == remainder])
+        get_seen_index().add('benchmark-{}'.format(i) for i in range(size) if i % 4 < 2)
+
+    def handle(self, *args, **options):
+        # The seeded rows are rolled back. Their ids stay in a Redis index,
+        # where they only cost a lookup should Flickr ever use them.
+        with transaction.atomic():
+            self.seed(max(options['sizes']))
+            query_counts = set()
+            for size in options['sizes']:
+                photos = [{'id': 'benchmark-{}'.format(i)} for i in range(size)]
+                with CaptureQueriesContext(connection) as context:
+                    started = time.time()
+                    filtered = get_filtered_images(photos, 0, options['perpage'])
+                    elapsed = time.time() - started
+                query_counts.add(len(context.captured_queries))
+                self.stdout.write('{:>6} photos: {} queries, {} untriaged, {:.1f} ms'.format(
+                    size, len(context.captured_queries), len(filtered), elapsed * 1000))
+            transaction.set_rollback(True)
+
+        if max(query_counts) > MAX_QUERIES:
+            raise CommandError('Query count grows with page size: {}'.format(sorted(query_counts)))
+        if not min(query_counts):
+            raise CommandError('No triaged ids were looked up, so nothing was measured.')
+        self.stdout.write(self.style.SUCCESS('Query count is constant.'))
@@ -0,0 +1,45 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from flickr.models import Image
+from flickr.serializers import ImageSerializer, IMAGE_LIST_FIELDS, image_row_data
+
+
+class Command(BaseCommand):
+    help = 'Measures rows per second of the image list endpoint serialization paths.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-sizes', nargs='+', type=int, default=[1000, 10000])
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def seed(self, count):
+        missing = count - Image.objects.count()
+        if missing > 0:
+            Image.objects.bulk_create([
+                Image(id='benchmark-{}'.format(i), secret='benchmark-{}'.format(i),
+                    owner='benchmark', server='1234', farm=1, license='4',
+                    title='Benchmark image', tags='benchmark synthetic')
+                for i in range(missing)])
+
+    def measure(self, page, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.time()
+            rows = len(page())
+            elapsed = time.time() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return rows / best if best else float('inf')
+
+    def handle(self, *args, **options):
+        # Synthetic rows are rolled back once the measurements are done.
+        with transaction.atomic():
+            self.seed(max(options['page_sizes']))
+            for page_size in options['page_sizes']:
+                serializer_rate = self.measure(lambda: ImageSerializer(
+                    Image.objects.all()[:page_size], many=True).data, options['repeat'])
+                values_rate = self.measure(lambda: [image_row_data(row) for row in
+                    Image.objects.values(*IMAGE_LIST_FIELDS)[:page_size]], options['repeat'])
+                self.stdout.write('page_size={:>6}: serializer {:>10.0f} rows/s, '
+                    'values {:>10.0f} rows/s ({:.1f}x)'.format(
+                        page_size, serializer_rate, values_rate, values_rate / serializer_rate))
+            transaction.set_rollback(True)
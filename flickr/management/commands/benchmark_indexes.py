@@ -0,0 +1,119 @@
+import json
+import random
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import six
+from flickr.models import Search, Image, DiscardedImage, Annotation, SemanticCheck, \
+    AnnotationSemanticCheck
+
+
+INDEXED_MODELS = (Search, Image, DiscardedImage, Annotation, AnnotationSemanticCheck)
+TRIGRAM_INDEX = 'flickr_search_tags_trgm_idx'
+
+
+class Command(BaseCommand):
+    help = 'Seeds synthetic data and prints EXPLAIN timings of the hot lookups with and ' \
+        'without their indexes. Indexes are dropped inside a transaction that is rolled ' \
+        'back, which locks the tables meanwhile, so run it against a scratch database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--searches', type=int, default=20000)
+        parser.add_argument('--images', type=int, default=100000)
+        parser.add_argument('--annotations', type=int, default=20000)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def seed(self, options):
+        Search.objects.bulk_create([
+            Search(tags='tag{} word{} benchmark{}'.format(i % 997, i, i), slug='benchmark-{}'.format(i),
+                licenses=['4'])
+            for i in range(options['searches'])])
+        for (model, prefix) in ((Image, 'benchmark'), (DiscardedImage, 'discarded')):
+            model.objects.bulk_create([
+                model(id='{}-{}'.format(prefix, i), secret='{}-{}'.format(prefix, i),
+                    owner='benchmark', server='1234', farm=1, license='4', tags='benchmark')
+                for i in range(options['images'])])
+        image_ids = list(Image.objects.values_list('id', flat=True)[:options['annotations']])
+        Annotation.objects.bulk_create([
+            Annotation(image_id=image_id, is_approved=random.random() < 0.3) for image_id in image_ids])
+        SemanticCheck.objects.bulk_create([
+            SemanticCheck(label='benchmark {}'.format(i)) for i in range(5)])
+        semantic_checks = list(SemanticCheck.objects.filter(label__startswith='benchmark '))
+        AnnotationSemanticCheck.objects.bulk_create([
+            AnnotationSemanticCheck(annotation_id=annotation_id, semantic_check=semantic_check,
+                value=random.random())
+            for annotation_id in Annotation.objects.values_list('id', flat=True)
+            for semantic_check in semantic_checks])
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+    def lookups(self):
+        annotation_id = Annotation.objects.order_by('pk').values_list('pk', flat=True).first()
+        return (
+            ('search tags icontains', Search.objects.filter(tags__icontains='word1234')),
+            ('search list', Search.objects.all()[:100]),
+            ('image list', Image.objects.all()[:100]),
+            ('discarded image list', DiscardedImage.objects.all()[:100]),
+            ('annotation list', Annotation.objects.all()[:100]),
+            ('annotation semantic checks', AnnotationSemanticCheck.objects.filter(annotation_id=annotation_id)),
+        )
+
+    def explain(self, queryset, repeat, phase):
+        """
+        Return the best execution time in milliseconds and a summary of the
+        plan of `queryset`.
+        """
+        (sql, params) = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                timings = []
+                for _ in range(repeat):
+                    cursor.execute('EXPLAIN (ANALYZE, FORMAT JSON) {}'.format(sql), params)
+                    plan = cursor.fetchone()[0]
+                    if isinstance(plan, six.string_types):
+                        plan = json.loads(plan)
+                    timings.append(plan[0]['Execution Time'])
+                node = plan[0]['Plan']
+                while node.get('Plans') and 'Index Name' not in node and node['Node Type'] in ('Limit', 'Sort'):
+                    node = node['Plans'][0]
+                summary = ' '.join(filter(None, (node['Node Type'], node.get('Index Name'))))
+                return (min(timings), summary)
+
+            # sqlite3 caches statements by text and doesn't replan a cached
+            # EXPLAIN after indexes are dropped, so each phase gets its own.
+            cursor.execute('EXPLAIN QUERY PLAN /* {} */ {}'.format(phase, sql), params)
+            summary = '; '.join(str(row[-1]) for row in cursor.fetchall())
+            timings = []
+            for _ in range(repeat):
+                started = time.time()
+                cursor.execute(sql, params)
+                cursor.fetchall()
+                timings.append((time.time() - started) * 1000)
+            return (min(timings), summary)
+
+    def drop_indexes(self):
+        names = [index.name for model in INDEXED_MODELS for index in model._meta.indexes]
+        with connection.cursor() as cursor:
+            for name in names:
+                cursor.execute('DROP INDEX {}'.format(connection.ops.quote_name(name)))
+            if connection.vendor == 'postgresql':
+                cursor.execute('DROP INDEX IF EXISTS {}'.format(TRIGRAM_INDEX))
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.seed(options)
+            lookups = self.lookups()
+            indexed = [self.explain(queryset, options['repeat'], 'indexed')
+                for (label, queryset) in lookups]
+            self.drop_indexes()
+            unindexed = [self.explain(queryset, options['repeat'], 'unindexed')
+                for (label, queryset) in lookups]
+
+            results = zip(lookups, unindexed, indexed)
+            for ((label, queryset), (before, before_plan), (after, after_plan)) in results:
+                self.stdout.write('{:<28} without indexes {:>9.2f} ms, with {:>9.2f} ms'.format(
+                    label, before, after))
+                self.stdout.write('    before: {}'.format(before_plan))
+                self.stdout.write('    after:  {}'.format(after_plan))
+            transaction.set_rollback(True)
@@ -0,0 +1,73 @@
+import io
+import random
+import time
+from django.core.management.base import BaseCommand
+from PIL import Image as PILImage, ImageDraw
+from flickr.masks import encode_mask, mask_to_rle
+from flickr.models import Annotation
+
+
+SIZES = ((640, 480), (1920, 1080), (3840, 2160))
+COLORS = ((255, 0, 0, 128), (0, 255, 0, 128), (0, 0, 255, 200))
+
+
+class Command(BaseCommand):
+    help = 'Reports bytes saved and encode/decode time of the compact paint mask encoding.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shapes', type=int, default=50)
+        parser.add_argument('--annotations', type=int, default=0,
+            help='Also measure the paint images of this many stored annotations.')
+
+    def make_mask(self, width, height, shapes):
+        mask = PILImage.new('RGBA', (width, height))
+        draw = ImageDraw.Draw(mask)
+        for _ in range(shapes):
+            x, y = random.randrange(width), random.randrange(height)
+            draw.ellipse((x, y, x + random.randrange(width // 20, width // 4),
+                y + random.randrange(height // 20, height // 4)), fill=random.choice(COLORS))
+        return mask
+
+    def report(self, label, original):
+        image = PILImage.open(io.BytesIO(original))
+        image.load()
+
+        started = time.time()
+        encoded = encode_mask(image)
+        encode_time = time.time() - started
+        if encoded is None:
+            self.stdout.write('{:<24} {:>10} bytes, not palettizable'.format(label, len(original)))
+            return (len(original), len(original))
+
+        started = time.time()
+        decoded = PILImage.open(io.BytesIO(encoded)).convert('RGBA')
+        decode_time = time.time() - started
+
+        started = time.time()
+        mask_to_rle(decoded)
+        rle_time = time.time() - started
+
+        self.stdout.write('{:<24} {:>10} -> {:>10} bytes ({:>5.1f}% saved), encode {:>6.0f} ms, '
+            'decode {:>5.0f} ms, rle {:>5.0f} ms'.format(
+                label, len(original), len(encoded), 100.0 * (1 - len(encoded) / len(original)),
+                encode_time * 1000, decode_time * 1000, rle_time * 1000))
+        return (len(original), len(encoded))
+
+    def handle(self, *args, **options):
+        totals = []
+        for (width, height) in SIZES:
+            output = io.BytesIO()
+            self.make_mask(width, height, options['shapes']).save(output, format='PNG')
+            totals.append(self.report('{}x{}'.format(width, height), output.getvalue()))
+
+        annotations = Annotation.objects.exclude(paint_image='') \
+            .only('id', 'paint_image')[:options['annotations']]
+        for annotation in annotations:
+            with annotation.paint_image.open('rb') as paint_image:
+                original = paint_image.read()
+            totals.append(self.report('annotation {}'.format(annotation.pk), original))
+
+        original_bytes = sum(original for (original, encoded) in totals)
+        encoded_bytes = sum(encoded for (original, encoded) in totals)
+        self.stdout.write('Total: {} -> {} bytes ({:.1f}% saved)'.format(
+            original_bytes, encoded_bytes, 100.0 * (1 - encoded_bytes / original_bytes)))
@@ -0,0 +1,104 @@
+import base64
+import io
+import json
+import os
+import random
+import resource
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image as PILImage, ImageDraw
+from rest_framework import parsers
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from flickr.parsers import ImageUploadParser
+from flickr.serializers import AnnotationSerializer, PaintImageSerializer
+
+
+class Command(BaseCommand):
+    help = 'Measures the peak RSS growth of parsing and validating a paint image upload, ' \
+        'sent as base64 JSON and as a binary upload. Each case runs in a forked process.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--width', type=int, default=3840)
+        parser.add_argument('--height', type=int, default=2160)
+        parser.add_argument('--shapes', type=int, default=200)
+        parser.add_argument('--noise', action='store_true',
+            help='Fill the mask with random pixels, the worst case for PNG compression.')
+
+    def make_mask(self, width, height, shapes, noise):
+        if noise:
+            mask = PILImage.frombytes('RGBA', (width, height), os.urandom(width * height * 4))
+        else:
+            mask = PILImage.new('RGBA', (width, height))
+            draw = ImageDraw.Draw(mask)
+            for _ in range(shapes):
+                x, y = random.randrange(width), random.randrange(height)
+                draw.ellipse((x, y, x + random.randrange(20, 400), y + random.randrange(20, 400)),
+                    fill=(255, 0, 0, 128))
+        output = io.BytesIO()
+        mask.save(output, format='PNG')
+        return output.getvalue()
+
+    def measure(self, django_request, parser_classes, get_paint_image):
+        """
+        Run one case in a forked process and return the type it stores and
+        how far it raised the process's peak RSS. Unlike tracemalloc, RSS
+        counts Pillow's native image buffers.
+        """
+        (read_fd, write_fd) = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            try:
+                request = Request(django_request, parsers=[parser() for parser in parser_classes])
+                before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                paint_image = get_paint_image(request)
+                after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+                unit = 1 if sys.platform == 'darwin' else 1024
+                result = {'type': type(paint_image).__name__, 'peak': (after - before) * unit}
+            except Exception as e:
+                result = {'error': repr(e)}
+            with os.fdopen(write_fd, 'w') as output:
+                json.dump(result, output)
+            os._exit(0)
+        os.close(write_fd)
+        with os.fdopen(read_fd) as output:
+            result = json.load(output)
+        os.waitpid(pid, 0)
+        if 'error' in result:
+            raise CommandError(result['error'])
+        return (result['type'], result['peak'])
+
+    def handle(self, *args, **options):
+        png = self.make_mask(options['width'], options['height'], options['shapes'], options['noise'])
+        self.stdout.write('{}x{} mask: {:.1f} MB PNG, {:.1f} MB as base64'.format(
+            options['width'], options['height'], len(png) / 2 ** 20,
+            len(base64.b64encode(png)) / 2 ** 20))
+
+        factory = APIRequestFactory()
+        path = '/api/v1/annotations/1/paint_image'
+
+        def validate_base64(request):
+            serializer = AnnotationSerializer()
+            return serializer.validate_paint_image(
+                serializer.fields['paint_image'].run_validation(request.data['paint_image']))
+
+        def validate_upload(request):
+            serializer = PaintImageSerializer(data={
+                'paint_image': request.data.get('paint_image', request.data.get('file'))})
+            serializer.is_valid(raise_exception=True)
+            return serializer.validated_data['paint_image']
+
+        cases = (
+            ('base64 JSON', factory.patch(path, {'paint_image': base64.b64encode(png).decode()},
+                format='json'), (parsers.JSONParser,), validate_base64),
+            ('multipart', factory.put(path, {'paint_image': io.BytesIO(png)}, format='multipart'),
+                (parsers.MultiPartParser,), validate_upload),
+            ('raw image/png', factory.put(path, png, content_type='image/png'),
+                (ImageUploadParser,), validate_upload),
+        )
+        for (label, django_request, parser_classes, get_paint_image) in cases:
+            (stored_type, peak) = self.measure(django_request, parser_classes, get_paint_image)
+            self.stdout.write('{:<14} peak RSS +{:>8.1f} MB, stored as {}'.format(
+                label, peak / 2 ** 20, stored_type))
@@ -0,0 +1,49 @@
+import uuid
+from django.core.management.base import BaseCommand, CommandError
+from flickr.seen import get_seen_index, triaged_image_ids, UnindexedSeenImages
+
+
+class Command(BaseCommand):
+    help = 'Checks that every selected and discarded image is present in the seen image index.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--probes', type=int, default=10000,
+            help='Number of unknown ids used to estimate the false positive rate.')
+        parser.add_argument('--repair', action='store_true',
+            help='Add missing ids to the index instead of failing.')
+
+    def handle(self, *args, **options):
+        index = get_seen_index()
+        if isinstance(index, UnindexedSeenImages):
+            self.stdout.write('REDIS_URL is not set, so there is no index to check.')
+            return
+        chunk_size = options['chunk_size']
+
+        checked = 0
+        missing = []
+        chunk = []
+        for image_id in triaged_image_ids():
+            chunk.append(image_id)
+            if len(chunk) == chunk_size:
+                missing.extend(set(chunk) - index.probable_ids(chunk))
+                checked += len(chunk)
+                chunk = []
+        if chunk:
+            missing.extend(set(chunk) - index.probable_ids(chunk))
+            checked += len(chunk)
+
+        probes = ['probe-{}'.format(uuid.uuid4().hex) for _ in range(options['probes'])]
+        false_positives = len(index.probable_ids(probes)) if probes else 0
+
+        self.stdout.write('Checked {} ids, {} missing.'.format(checked, len(missing)))
+        if probes:
+            self.stdout.write('Estimated false positive rate: {:.4%}'.format(
+                false_positives / len(probes)))
+
+        if missing:
+            if not options['repair']:
+                raise CommandError('Seen image index is missing {} ids, run with --repair '
+                    'or rebuild_seen_index.'.format(len(missing)))
+            index.add(missing)
+            self.stdout.write(self.style.SUCCESS('Added {} missing ids.'.format(len(missing))))
@@ -0,0 +1,47 @@
+import os
+from xml.etree import ElementTree
+from django.core.management.base import BaseCommand, CommandError
+from flickr.export import EXPORT_FORMATS, export_queryset, annotation_rows, voc_annotation
+from flickr.models import Search
+
+
+class Command(BaseCommand):
+    help = 'Streams annotations to a COCO, Pascal VOC or JSON lines file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', dest='export_format', choices=sorted(EXPORT_FORMATS), default='jsonl')
+        parser.add_argument('--output', default='-',
+            help='File to write, "-" for stdout. A directory writes one VOC file per annotation.')
+        approval = parser.add_mutually_exclusive_group()
+        approval.add_argument('--approved', dest='is_approved', action='store_true', default=None)
+        approval.add_argument('--unapproved', dest='is_approved', action='store_false')
+        parser.add_argument('--search', type=int, help='Only annotations of images selected by this search.')
+
+    def handle(self, *args, **options):
+        search = None
+        if options['search'] is not None:
+            try:
+                search = Search.objects.get(pk=options['search'])
+            except Search.DoesNotExist:
+                raise CommandError('Search {} does not exist.'.format(options['search']))
+        annotations = export_queryset(is_approved=options['is_approved'], search=search)
+
+        if os.path.isdir(options['output']):
+            if options['export_format'] != 'voc':
+                raise CommandError('Only the voc format can be written to a directory.')
+            count = 0
+            for row in annotation_rows(annotations):
+                path = os.path.join(options['output'], '{}.xml'.format(row['id']))
+                ElementTree.ElementTree(voc_annotation(row)).write(path, encoding='utf-8', xml_declaration=True)
+                count += 1
+            self.stderr.write('Wrote {} annotations to {}.'.format(count, options['output']))
+            return
+
+        (exporter, content_type, extension) = EXPORT_FORMATS[options['export_format']]
+        if options['output'] == '-':
+            for chunk in exporter(annotations):
+                self.stdout.write(chunk, ending='')
+            return
+        with open(options['output'], 'w', encoding='utf-8') as output:
+            for chunk in exporter(annotations):
+                output.write(chunk)
@@ -0,0 +1,63 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from flickr.export import export_queryset
+from flickr.shards import shard_ranges, shard_name, pack_shard, read_manifest, write_manifest
+
+
+class Command(BaseCommand):
+    help = 'Packs approved annotations with their photos and masks into sharded tar archives.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Directory to write the shards and manifest to.')
+        parser.add_argument('--shards', type=int, default=16)
+        parser.add_argument('--workers', type=int, default=settings.EXPORT_SHARD_WORKERS)
+        parser.add_argument('--all', dest='is_approved', action='store_const', const=None, default=True,
+            help='Include annotations that are not approved.')
+        parser.add_argument('--restart', action='store_true',
+            help='Ignore the manifest of a previous run and split the shards again.')
+
+    def handle(self, *args, **options):
+        output_dir = options['output']
+        os.makedirs(output_dir, exist_ok=True)
+
+        manifest = None if options['restart'] else read_manifest(output_dir)
+        if manifest is not None and manifest['is_approved'] != options['is_approved']:
+            raise CommandError('The manifest in {} was written with a different --all setting; '
+                'use --restart to start over.'.format(output_dir))
+        if manifest is None:
+            ranges = shard_ranges(export_queryset(is_approved=options['is_approved']), options['shards'])
+            manifest = {
+                'is_approved': options['is_approved'],
+                'shards': [{'name': shard_name(index), 'first_pk': first_pk, 'last_pk': last_pk,
+                    'annotations': count, 'done': False} for (index, (first_pk, last_pk, count)) in enumerate(ranges)],
+            }
+            write_manifest(output_dir, manifest)
+
+        pending = [(index, shard) for (index, shard) in enumerate(manifest['shards'])
+            if not (shard['done'] and os.path.exists(os.path.join(output_dir, shard['tar'])))]
+        self.stdout.write('{} of {} shards to pack.'.format(len(pending), len(manifest['shards'])))
+
+        # Forked workers must open their own database connections.
+        connections.close_all()
+        failed = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            futures = {executor.submit(pack_shard, output_dir, index, shard['first_pk'], shard['last_pk'],
+                options['is_approved']): shard for (index, shard) in pending}
+            for future in as_completed(futures):
+                shard = futures[future]
+                try:
+                    shard.update(future.result(), done=True)
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write('{} failed: {}'.format(shard['name'], e))
+                    continue
+                write_manifest(output_dir, manifest)
+                self.stdout.write('{name}: {samples} samples, {skipped} skipped'.format(**shard))
+
+        if failed:
+            raise CommandError('{} shards failed; run the command again to resume.'.format(failed))
+        self.stdout.write(self.style.SUCCESS('Packed {} shards into {}.'.format(
+            len(manifest['shards']), output_dir)))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from flickr.cache import get_response_cache
+
+
+class Command(BaseCommand):
+    help = 'Prints hit and miss counters of the Flickr response cache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clear', action='store_true',
+            help='Drop every cached response and reset the counters.')
+
+    def handle(self, *args, **options):
+        cache = get_response_cache()
+        if cache is None:
+            self.stdout.write('Flickr response cache is disabled.')
+            return
+        stats = cache.stats()
+        self.stdout.write('{}: {hits} hits, {misses} misses, {size} entries'.format(
+            cache.__class__.__name__, **stats))
+        if options['clear']:
+            cache.clear()
+            self.stdout.write(self.style.SUCCESS('Cleared.'))
@@ -0,0 +1,40 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.files.storage import get_storage_class
+from django.core.management.base import BaseCommand, CommandError
+from fat.custom_storages import SpoolingMediaStorage
+
+
+class Command(BaseCommand):
+    help = 'Uploads every file left in the media spool to the remote storage.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.MEDIA_SPOOL_WORKERS)
+        parser.add_argument('--min-age', type=int, default=0,
+            help='Skip files spooled less than this many seconds ago, which the web '
+                'processes may still be uploading.')
+
+    def stale_names(self, storage, min_age):
+        spooled_before = time.time() - min_age
+        for name in storage.spooled_names():
+            try:
+                if os.path.getmtime(storage.spool.path(name)) <= spooled_before:
+                    yield name
+            except FileNotFoundError:
+                # Uploaded in the meantime.
+                continue
+
+    def handle(self, *args, **options):
+        storage = get_storage_class()()
+        if not isinstance(storage, SpoolingMediaStorage):
+            raise CommandError('DEFAULT_FILE_STORAGE is not a SpoolingMediaStorage.')
+
+        names = list(self.stale_names(storage, options['min_age']))
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            uploaded = sum(executor.map(storage.upload, names))
+        self.stdout.write(self.style.SUCCESS('Uploaded {} of {} spooled files.'.format(
+            uploaded, len(names))))
+        if uploaded < len(names):
+            raise CommandError('{} files are still spooled.'.format(len(names) - uploaded))
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from flickr.connections import get_redis
+from flickr.harvest import harvest_search, dequeue_harvest
+from flickr.models import Search
+
+
+class Command(BaseCommand):
+    help = 'Stages the Flickr results of searches as triage candidates.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('search_ids', nargs='*', type=int,
+            help='Searches to harvest. Defaults to every unfinished search.')
+        parser.add_argument('--concurrency', type=int, default=None,
+            help='Flickr pages fetched in parallel.')
+        parser.add_argument('--max-pages', type=int, default=None,
+            help='Stop each search after this many pages; later runs resume.')
+        parser.add_argument('--watch', action='store_true',
+            help='Keep running and harvest searches queued in Redis.')
+
+    def harvest(self, search, options):
+        stored = harvest_search(search,
+            concurrency=options['concurrency'], max_pages=options['max_pages'])
+        cursor = search.harvest_cursor
+        self.stdout.write('{}: {} candidates stored, next page {} of {}{}'.format(
+            search, stored, cursor.next_page, cursor.pages,
+            ' (finished)' if cursor.is_finished else ''))
+
+    def handle(self, *args, **options):
+        if options['search_ids']:
+            searches = Search.objects.filter(pk__in=options['search_ids'])
+        else:
+            searches = Search.objects.exclude(harvest_cursor__is_finished=True)
+        for search in searches:
+            self.harvest(search, options)
+
+        if options['watch']:
+            if get_redis() is None:
+                raise CommandError('--watch needs REDIS_URL to be configured.')
+            while True:
+                # Drop connections the database closed or that outlived
+                # CONN_MAX_AGE while waiting, as Django does per request.
+                close_old_connections()
+                search_id = dequeue_harvest()
+                if search_id is None:
+                    continue
+                try:
+                    search = Search.objects.get(pk=search_id)
+                except Search.DoesNotExist:
+                    continue
+                self.harvest(search, options)
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from flickr.mirror import get_image_mirror
+
+
+class Command(BaseCommand):
+    help = 'Evicts the least recently used photos from the local image mirror.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-bytes', type=int,
+            help='Evict down to this size instead of 90% of IMAGE_MIRROR_MAX_BYTES.')
+
+    def handle(self, *args, **options):
+        mirror = get_image_mirror()
+        evicted = mirror.evict(options['max_bytes'])
+        self.stdout.write(self.style.SUCCESS('Evicted {} photos, {} bytes remain.'.format(
+            evicted, mirror.size)))
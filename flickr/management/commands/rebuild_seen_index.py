@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from flickr.seen import get_seen_index, UnindexedSeenImages
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the seen image index from the selected and discarded image tables.'
+
+    def handle(self, *args, **options):
+        index = get_seen_index()
+        if isinstance(index, UnindexedSeenImages):
+            self.stdout.write('REDIS_URL is not set, so there is no index to rebuild.')
+            return
+        index.rebuild()
+        self.stdout.write(self.style.SUCCESS('Rebuilt {} ({} bits, {} hashes).'.format(
+            index.__class__.__name__, index.bits, index.hashes)))
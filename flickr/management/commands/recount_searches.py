@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from flickr.cache import invalidate_namespace
+from flickr.models import Search, HarvestCursor
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the denormalized selected image and Flickr total counters of searches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('search_ids', nargs='*', type=int,
+            help='Searches to recount. Defaults to every search.')
+
+    def handle(self, *args, **options):
+        # Discarded images aren't linked to a search, so discarded_count
+        # can only be maintained by the ingest, not recomputed.
+        searches = Search.objects.annotate(image_count=Count('images'))
+        if options['search_ids']:
+            searches = searches.filter(pk__in=options['search_ids'])
+        harvested_totals = dict(HarvestCursor.objects.filter(
+            total__isnull=False).values_list('search_id', 'total'))
+
+        repaired = 0
+        for search in searches:
+            fields = {}
+            if search.selected_count != search.image_count:
+                fields['selected_count'] = search.image_count
+            harvested_total = harvested_totals.get(search.pk)
+            if harvested_total is not None and search.flickr_total != harvested_total:
+                fields['flickr_total'] = harvested_total
+            if fields:
+                Search.objects.filter(pk=search.pk).update(**fields)
+                self.stdout.write('{}: {}'.format(search, ', '.join(
+                    '{} {} -> {}'.format(name, getattr(search, name), value)
+                    for (name, value) in sorted(fields.items()))))
+                repaired += 1
+
+        if repaired:
+            invalidate_namespace('searches')
+        self.stdout.write(self.style.SUCCESS('Repaired {} searches.'.format(repaired)))
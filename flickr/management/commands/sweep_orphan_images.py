@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from flickr.models import Image, delete_orphan_images
+
+
+class Command(BaseCommand):
+    help = 'Deletes selected images that belong to no search and have no annotation.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        deleted = 0
+        while True:
+            image_ids = list(Image.objects.filter(search=None, annotation=None)
+                .order_by().values_list('id', flat=True)[:options['batch_size']])
+            if not image_ids:
+                break
+            with transaction.atomic():
+                (count, per_model) = delete_orphan_images(image_ids)
+            deleted += per_model.get(Image._meta.label, 0)
+        self.stdout.write(self.style.SUCCESS('Deleted {} orphan images.'.format(deleted)))
@@ -0,0 +1,91 @@
+import io
+import os
+import re
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image as PILImage
+
+
+# Masks with more distinct colors than a palette holds are stored as sent.
+MAX_PALETTE_COLORS = 256
+
+RUN_PATTERN = re.compile(b'\x00+|\xff+')
+
+
+def _palette_bits(colors):
+    for bits in (1, 2, 4):
+        if colors <= 1 << bits:
+            return bits
+    return 8
+
+
+def encode_mask(image):
+    """
+    Return PNG bytes of the RGBA `image` as a palettized PNG with the
+    fewest bits per pixel that hold its colors, or None when the image
+    has too many colors to palettize without loss.
+    """
+    if image.mode != 'RGBA':
+        image = image.convert('RGBA')
+    colors = image.getcolors(MAX_PALETTE_COLORS)
+    if colors is None:
+        return None
+    palettized = image.quantize(colors=len(colors), method=PILImage.FASTOCTREE)
+    # The quantization is lossless when every palette entry in use stands
+    # for exactly one color of the image, alpha included.
+    palette = palettized.im.getpalette('RGBA', 'RGBA')
+    used = [(count, tuple(palette[index * 4:index * 4 + 4]))
+        for (count, index) in palettized.getcolors(MAX_PALETTE_COLORS)]
+    if sorted(used) != sorted(colors):
+        return None
+    output = io.BytesIO()
+    palettized.save(output, format='PNG', optimize=True, bits=_palette_bits(len(colors)))
+    return output.getvalue()
+
+
+def compact_mask(paint_image):
+    """
+    Re-encode an uploaded paint image as a palettized PNG when that is
+    smaller, keeping its name with a `.png` extension. Returns the upload
+    unchanged otherwise, without decoding it when it is already
+    palettized or larger than `MASK_COMPACT_MAX_PIXELS`.
+    """
+    paint_image.seek(0)
+    image = PILImage.open(paint_image)
+    (width, height) = image.size
+    encoded = None
+    if image.mode != 'P' and width * height <= settings.MASK_COMPACT_MAX_PIXELS:
+        encoded = encode_mask(image)
+    if encoded is None or len(encoded) >= paint_image.size:
+        paint_image.seek(0)
+        return paint_image
+    name = '{}.png'.format(os.path.splitext(os.path.basename(paint_image.name or 'mask'))[0])
+    return ContentFile(encoded, name=name)
+
+
+def decode_mask(paint_image):
+    """
+    Return the stored paint image as an RGBA Pillow image.
+    """
+    paint_image.open('rb')
+    try:
+        image = PILImage.open(paint_image)
+        return image.convert('RGBA')
+    finally:
+        paint_image.close()
+
+
+def mask_to_rle(image):
+    """
+    Return the painted pixels of an RGBA `image` (alpha above zero) as an
+    uncompressed COCO run-length encoding: column-major runs that start
+    with a run of unpainted pixels.
+    """
+    (width, height) = image.size
+    painted = image.getchannel('A').point(lambda alpha: 255 if alpha else 0)
+    data = painted.transpose(PILImage.TRANSPOSE).tobytes()
+    counts = []
+    if data[:1] == b'\xff':
+        counts.append(0)
+    counts.extend(match.end() - match.start() for match in RUN_PATTERN.finditer(data))
+    return {'size': [height, width], 'counts': counts}
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 17:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flickr', '0007_auto_20170807_1905'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Candidate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('photo_id', models.CharField(max_length=255)),
+                ('position', models.IntegerField()),
+                ('title', models.CharField(blank=True, max_length=255, null=True)),
+                ('owner', models.CharField(max_length=255)),
+                ('secret', models.CharField(max_length=255)),
+                ('server', models.CharField(max_length=255)),
+                ('farm', models.IntegerField()),
+                ('license', models.CharField(blank=True, choices=[(0, 'All Rights Reserved'), (1, 'Attribution-NonCommercial-ShareAlike License'), (2, 'Attribution-NonCommercial License'), (3, 'Attribution-NonCommercial-NoDerivs License'), (4, 'Attribution License'), (5, 'Attribution-ShareAlike License'), (6, 'Attribution-NoDerivs License'), (7, 'No known copyright restrictions'), (8, 'United States Government Work')], max_length=2, null=True)),
+                ('tags', models.TextField(blank=True, null=True)),
+                ('ispublic', models.NullBooleanField()),
+                ('isfriend', models.NullBooleanField()),
+                ('isfamily', models.NullBooleanField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('search', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='candidates', to='flickr.Search')),
+            ],
+            options={
+                'verbose_name': 'Candidate',
+                'verbose_name_plural': 'Candidates',
+                'ordering': ['search', 'position'],
+            },
+        ),
+        migrations.CreateModel(
+            name='HarvestCursor',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('next_page', models.IntegerField(default=1)),
+                ('pages', models.IntegerField(blank=True, null=True)),
+                ('total', models.IntegerField(blank=True, null=True)),
+                ('is_finished', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('search', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='harvest_cursor', to='flickr.Search')),
+            ],
+            options={
+                'verbose_name': 'Harvest cursor',
+                'verbose_name_plural': 'Harvest cursors',
+                'ordering': ['-updated_at'],
+                'get_latest_by': 'updated_at',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='candidate',
+            unique_together=set([('search', 'photo_id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='candidate',
+            index_together=set([('search', 'position')]),
+        ),
+    ]
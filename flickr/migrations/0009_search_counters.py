@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 17:03
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_selected_images(apps, schema_editor):
+    Search = apps.get_model('flickr', 'Search')
+    for search in Search.objects.annotate(image_count=Count('images')):
+        Search.objects.filter(pk=search.pk).update(selected_count=search.image_count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flickr', '0008_candidate_harvestcursor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='search',
+            name='discarded_count',
+            field=models.IntegerField(default=0, verbose_name='Discarded'),
+        ),
+        migrations.AddField(
+            model_name='search',
+            name='flickr_total',
+            field=models.IntegerField(default=0, verbose_name='Flickr total'),
+        ),
+        migrations.AddField(
+            model_name='search',
+            name='selected_count',
+            field=models.IntegerField(default=0, verbose_name='Selected'),
+        ),
+        migrations.RunPython(count_selected_images, reverse_code=migrations.RunPython.noop),
+    ]
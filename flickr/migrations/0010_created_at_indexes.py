@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 17:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flickr', '0009_search_counters'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='discardedimage',
+            options={'get_latest_by': 'updated_at', 'ordering': ['-created_at', '-updated_at'], 'verbose_name': 'Discarded image', 'verbose_name_plural': 'Discarded images'},
+        ),
+        migrations.AlterModelOptions(
+            name='image',
+            options={'get_latest_by': 'updated_at', 'ordering': ['-created_at', '-updated_at'], 'verbose_name': 'Selected image', 'verbose_name_plural': 'Selected images'},
+        ),
+        migrations.AddIndex(
+            model_name='annotation',
+            index=models.Index(fields=['created_at'], name='flickr_annotation_created_idx'),
+        ),
+    ]
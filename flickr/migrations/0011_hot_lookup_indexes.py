@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 17:18
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def create_tags_trigram_index(apps, schema_editor):
+    # SearchViewSet filters on tags__icontains, which PostgreSQL runs as
+    # UPPER(tags) LIKE UPPER(%s), so the trigram index covers UPPER(tags).
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        'CREATE INDEX flickr_search_tags_trgm_idx ON flickr_search '
+        'USING gin (UPPER(tags) gin_trgm_ops)')
+
+
+def drop_tags_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS flickr_search_tags_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flickr', '0010_created_at_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='annotation',
+            index=models.Index(fields=['-is_approved', '-created_at', '-updated_at'], name='flickr_annotation_ordering_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='annotationsemanticcheck',
+            index=models.Index(fields=['annotation', '-value'], name='flickr_asc_value_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='discardedimage',
+            index=models.Index(fields=['-created_at', '-updated_at'], name='flickr_discarded_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['-created_at', '-updated_at'], name='flickr_image_created_upd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='search',
+            index=models.Index(fields=['-created_at', '-updated_at'], name='flickr_search_created_upd_idx'),
+        ),
+        migrations.RunPython(create_tags_trigram_index, drop_tags_trigram_index),
+    ]
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 17:21
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flickr', '0011_hot_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiscardedImageTag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='image_tags', to='flickr.DiscardedImage')),
+            ],
+            options={
+                'verbose_name': 'Discarded image tag',
+                'verbose_name_plural': 'Discarded image tags',
+            },
+        ),
+        migrations.CreateModel(
+            name='ImageTag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='image_tags', to='flickr.Image')),
+            ],
+            options={
+                'verbose_name': 'Image tag',
+                'verbose_name_plural': 'Image tags',
+            },
+        ),
+        migrations.CreateModel(
+            name='SearchTag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('search', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tags', to='flickr.Search')),
+            ],
+            options={
+                'verbose_name': 'Search tag',
+                'verbose_name_plural': 'Search tags',
+            },
+        ),
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+            ],
+            options={
+                'verbose_name': 'Tag',
+                'verbose_name_plural': 'Tags',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='searchtag',
+            name='tag',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tags', to='flickr.Tag'),
+        ),
+        migrations.AddField(
+            model_name='imagetag',
+            name='tag',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='image_tags', to='flickr.Tag'),
+        ),
+        migrations.AddField(
+            model_name='discardedimagetag',
+            name='tag',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='discarded_image_tags', to='flickr.Tag'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='searchtag',
+            unique_together=set([('tag', 'search')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='imagetag',
+            unique_together=set([('tag', 'image')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='discardedimagetag',
+            unique_together=set([('tag', 'image')]),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 17:55
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flickr', '0012_tag_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MirroredThumbnail',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.CharField(max_length=255)),
+                ('options', models.CharField(max_length=255)),
+                ('name', models.CharField(max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Mirrored thumbnail',
+                'verbose_name_plural': 'Mirrored thumbnails',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='mirroredthumbnail',
+            unique_together=set([('url', 'options')]),
+        ),
+    ]
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.images import ImageFile
+from .client import get_client
+from .models import MirroredThumbnail
+
+
+logger = logging.getLogger(__name__)
+
+
+class ImageMirror(object):
+    """
+    Size-bounded local cache of Flickr photos.
+
+    Photos are fetched on first access and stored under a hash of their
+    URL, which carries the photo's secret. Every access touches the file's
+    modification time, and when the mirror grows past `max_bytes` the least
+    recently used photos are evicted down to 90% of it. Thumbnails are
+    made from the mirrored photo by sorl-thumbnail, kept in its storage and
+    recorded as `MirroredThumbnail`s, so they outlive both eviction and the
+    photo's removal from Flickr.
+    """
+
+    def __init__(self, root=None, max_bytes=None, client=None):
+        self.storage = FileSystemStorage(location=root or settings.IMAGE_MIRROR_ROOT)
+        self.max_bytes = max_bytes or settings.IMAGE_MIRROR_MAX_BYTES
+        self.client = client or get_client()
+        self.lock = threading.Lock()
+        self._size = None
+
+    def name(self, url):
+        digest = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return '{}/{}{}'.format(digest[:2], digest, os.path.splitext(url)[1])
+
+    def files(self):
+        for (root, dirs, files) in os.walk(self.storage.location):
+            for filename in files:
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield (stat.st_mtime, stat.st_size, path)
+
+    @property
+    def size(self):
+        if self._size is None:
+            self._size = sum(size for (mtime, size, path) in self.files())
+        return self._size
+
+    def fetch(self, url):
+        """
+        Return the path of the mirrored photo at `url`, downloading it on
+        first access, or None when it can't be downloaded.
+        """
+        path = self.storage.path(self.name(url))
+        try:
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            pass
+
+        content = self.client.download(url)
+        if content is None:
+            return None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = '{}.{}.partial'.format(path, threading.get_ident())
+        with open(partial, 'wb') as output:
+            output.write(content)
+        os.replace(partial, path)
+
+        with self.lock:
+            self._size = self.size + len(content)
+            if self._size > self.max_bytes:
+                self.evict()
+        return path
+
+    def evict(self, target_bytes=None):
+        """
+        Delete the least recently used photos until the mirror holds at
+        most `target_bytes`, 90% of `max_bytes` by default.
+        """
+        target_bytes = int(self.max_bytes * 0.9) if target_bytes is None else target_bytes
+        files = sorted(self.files())
+        size = sum(size for (mtime, size, path) in files)
+        evicted = 0
+        for (mtime, file_size, path) in files:
+            if size <= target_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= file_size
+            evicted += 1
+        self._size = size
+        return evicted
+
+    def thumbnail_options(self, geometry, options):
+        return json.dumps([geometry, sorted(options.items())])
+
+    def stored_thumbnail(self, url, geometry, options):
+        """
+        Return the recorded thumbnail of the photo at `url`, or None. The
+        photo itself isn't read, so this works after it was evicted or
+        removed from Flickr.
+        """
+        name = MirroredThumbnail.objects.filter(
+            url=url, options=self.thumbnail_options(geometry, options)).values_list('name', flat=True).first()
+        return ImageFile(name, default.storage) if name is not None else None
+
+    def thumbnail(self, url, geometry=None, **options):
+        """
+        Return the sorl-thumbnail of the photo at `url`, making it from
+        the mirrored photo when there is none yet, or None when the photo
+        can't be downloaded or read.
+        """
+        geometry = geometry or settings.IMAGE_MIRROR_THUMBNAIL_GEOMETRY
+        options.setdefault('crop', 'center')
+        thumbnail = self.stored_thumbnail(url, geometry, options)
+        if thumbnail is not None:
+            return thumbnail
+        if self.fetch(url) is None:
+            return None
+        thumbnail = get_thumbnail(ImageFile(self.name(url), self.storage), geometry, **options)
+        # sorl-thumbnail returns a thumbnail it couldn't write when the photo can't be read.
+        if not thumbnail.exists():
+            return None
+        MirroredThumbnail.objects.get_or_create(
+            url=url, options=self.thumbnail_options(geometry, options), defaults={'name': thumbnail.name})
+        return thumbnail
+
+
+_mirror = None
+
+
+def get_image_mirror():
+    """
+    Return the process-wide image mirror.
+    """
+    global _mirror
+    if _mirror is None:
+        _mirror = ImageMirror()
+    return _mirror
@@ -2,14 +2,58 @@ import uuid
 from urllib.request import urlopen
 from django.core.files import File
 from django.core.files.temp import NamedTemporaryFile
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import F
 from django.conf import settings
+from django.core import signing
+from django.utils.crypto import constant_time_compare
 from django.utils.translation import ugettext_lazy as _
-from django.db.models.signals import pre_save, post_save, post_delete
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
 from django.dispatch.dispatcher import receiver
 from django_extensions.db.fields import AutoSlugField
 from sorl.thumbnail import ImageField
 from multiselectfield import MultiSelectField
+from .cache import invalidate_facets, invalidate_namespace
+
+
+def get_flickr_image_base(farm, server, id, secret):
+    return settings.FLICKR_IMAGE_URL.format(farm=farm, server=server, id=id, secret=secret)
+
+
+def get_mirror_base_url(request=None):
+    """
+    Return the absolute URL of the image mirror. The frontend is served
+    from another origin, so a relative IMAGE_MIRROR_URL is resolved
+    against the host of `request`.
+    """
+    if request is not None:
+        return request.build_absolute_uri(settings.IMAGE_MIRROR_URL)
+    return settings.IMAGE_MIRROR_URL
+
+
+def get_mirror_signature(path):
+    """
+    Return the signature of the image mirror `path`. The mirror only serves
+    signed paths, so it can't be made to fetch photos the API didn't link.
+    """
+    return signing.Signer(salt='flickr.mirror').signature(path)
+
+
+def check_mirror_signature(path, signature):
+    return constant_time_compare(get_mirror_signature(path), signature)
+
+
+def get_cached_image_url(farm, server, id, secret, size='original', base_url=None):
+    """
+    Return the signed URL of a photo, or of its thumbnail with size
+    'thumbnail', in the local image mirror under `base_url`, or on Flickr
+    when the mirror is disabled.
+    """
+    if not settings.IMAGE_MIRROR_ENABLED:
+        suffix = '_q' if size == 'thumbnail' else ''
+        return '{}{}.jpg'.format(get_flickr_image_base(farm, server, id, secret), suffix)
+    path = '{}/{}/{}/{}_{}.jpg'.format(size, farm, server, id, secret)
+    return '{}{}?signature={}'.format(base_url or settings.IMAGE_MIRROR_URL, path, get_mirror_signature(path))
 
 
 class FlickrImage(models.Model):
@@ -40,8 +84,7 @@ class FlickrImage(models.Model):
         return '{}'.format(self.id)
 
     def get_flickr_image_base(self):
-        return 'https://farm{}.staticflickr.com/{}/{}_{}'.format(
-            self.farm, self.server, self.id, self.secret)
+        return get_flickr_image_base(self.farm, self.server, self.id, self.secret)
 
     @property
     def get_flickr_url(self):
@@ -51,19 +94,37 @@ class FlickrImage(models.Model):
     def get_flickr_thumbnail(self):
         return '{}_q.jpg'.format(self.get_flickr_image_base())
 
+    @property
+    def get_cached_url(self):
+        return get_cached_image_url(self.farm, self.server, self.id, self.secret)
+
+    @property
+    def get_cached_thumbnail(self):
+        return get_cached_image_url(self.farm, self.server, self.id, self.secret, size='thumbnail')
+
+    def get_cached_image_url(self, size='original', request=None):
+        return get_cached_image_url(self.farm, self.server, self.id, self.secret,
+            size=size, base_url=get_mirror_base_url(request))
+
 
 class DiscardedImage(FlickrImage):
 
-    class Meta:
+    class Meta(FlickrImage.Meta):
         verbose_name = _('Discarded image')
         verbose_name_plural = _('Discarded images')
+        indexes = [
+            models.Index(fields=['-created_at', '-updated_at'], name='flickr_discarded_created_idx'),
+        ]
 
 
 class Image(FlickrImage):
 
-    class Meta:
+    class Meta(FlickrImage.Meta):
         verbose_name = _('Selected image')
         verbose_name_plural = _('Selected images')
+        indexes = [
+            models.Index(fields=['-created_at', '-updated_at'], name='flickr_image_created_upd_idx'),
+        ]
 
 
 class Search(models.Model):
@@ -83,15 +144,243 @@ class Search(models.Model):
     licenses = MultiSelectField(max_length=20, choices=settings.FLICKR_LICENSES)
     images = models.ManyToManyField(Image, related_name='search', blank=True)
 
+    # Denormalized triage counters, maintained by the triage ingest and
+    # repaired by the recount_searches command.
+    selected_count = models.IntegerField(_('Selected'), default=0)
+    discarded_count = models.IntegerField(_('Discarded'), default=0)
+    flickr_total = models.IntegerField(_('Flickr total'), default=0)
+
     class Meta:
         verbose_name = _('Search')
         verbose_name_plural = _('Searches')
         get_latest_by = 'updated_at'
         ordering = ['-created_at', '-updated_at']
+        indexes = [
+            models.Index(fields=['-created_at', '-updated_at'], name='flickr_search_created_upd_idx'),
+        ]
 
     def __str__(self):
         return '{}'.format(self.tags)
 
+    @property
+    def remaining_count(self):
+        return max(self.flickr_total - self.selected_count - self.discarded_count, 0)
+
+
+def split_tags(tags, separator=None):
+    """
+    Return the distinct tag names of a tag string in order, lowercased when
+    `FORCE_LOWERCASE_TAGS` is set. Flickr separates image tags with spaces,
+    searches separate theirs with commas.
+    """
+    names = []
+    for name in (tags or '').split(separator):
+        name = name.strip()
+        if settings.FORCE_LOWERCASE_TAGS:
+            name = name.lower()
+        if name and len(name) <= Tag.NAME_MAX_LENGTH and name not in names:
+            names.append(name)
+    return names
+
+
+class TagManager(models.Manager):
+
+    # Keeps `name IN (...)` under the SQLite variable limit.
+    LOOKUP_CHUNK_SIZE = 500
+
+    def _ids(self, names):
+        ids = {}
+        for start in range(0, len(names), self.LOOKUP_CHUNK_SIZE):
+            ids.update(self.filter(
+                name__in=names[start:start + self.LOOKUP_CHUNK_SIZE]).values_list('name', 'id'))
+        return ids
+
+    def get_ids(self, names):
+        """
+        Return a dict of tag name to id for `names`, inserting the missing
+        tags with a single bulk insert.
+        """
+        names = list(set(names))
+        ids = self._ids(names)
+        missing = [name for name in names if name not in ids]
+        if missing:
+            try:
+                with transaction.atomic():
+                    self.bulk_create([self.model(name=name) for name in missing])
+            except IntegrityError:
+                # A concurrent ingest inserted some of them first.
+                for name in missing:
+                    self.get_or_create(name=name)
+            ids.update(self._ids(missing))
+        return ids
+
+
+class Tag(models.Model):
+
+    NAME_MAX_LENGTH = 255
+
+    name = models.CharField(max_length=NAME_MAX_LENGTH, unique=True)
+
+    objects = TagManager()
+
+    class Meta:
+        verbose_name = _('Tag')
+        verbose_name_plural = _('Tags')
+        ordering = ['name']
+
+    def __str__(self):
+        return '{}'.format(self.name)
+
+
+# The inverted index of tags. Each link table is unique on (tag, object),
+# so listing the objects with a tag is a scan of that index.
+
+class ImageTag(models.Model):
+
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='image_tags')
+    image = models.ForeignKey(Image, on_delete=models.CASCADE, related_name='image_tags')
+
+    class Meta:
+        verbose_name = _('Image tag')
+        verbose_name_plural = _('Image tags')
+        unique_together = ('tag', 'image')
+
+
+class DiscardedImageTag(models.Model):
+
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='discarded_image_tags')
+    image = models.ForeignKey(DiscardedImage, on_delete=models.CASCADE, related_name='image_tags')
+
+    class Meta:
+        verbose_name = _('Discarded image tag')
+        verbose_name_plural = _('Discarded image tags')
+        unique_together = ('tag', 'image')
+
+
+class SearchTag(models.Model):
+
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='search_tags')
+    search = models.ForeignKey(Search, on_delete=models.CASCADE, related_name='search_tags')
+
+    class Meta:
+        verbose_name = _('Search tag')
+        verbose_name_plural = _('Search tags')
+        unique_together = ('tag', 'search')
+
+
+def link_tags(through, field_name, tags_by_pk):
+    """
+    Link objects to their tags through `through`, whose foreign key to the
+    object is `field_name`. `tags_by_pk` maps object primary keys to tag
+    names. Existing links are kept, and returns how many were inserted.
+    """
+    tag_ids = Tag.objects.get_ids(name for names in tags_by_pk.values() for name in names)
+    if not tag_ids:
+        return 0
+    object_field = '{}_id'.format(field_name)
+    existing = set(through.objects.filter(**{object_field + '__in': list(tags_by_pk)})
+        .values_list(object_field, 'tag_id'))
+    return len(through.objects.bulk_create([
+        through(**{object_field: pk, 'tag_id': tag_ids[name]})
+        for (pk, names) in tags_by_pk.items() for name in names
+        if (pk, tag_ids[name]) not in existing]))
+
+
+class HarvestCursor(models.Model):
+
+    search = models.OneToOneField(Search, on_delete=models.CASCADE, related_name='harvest_cursor')
+    next_page = models.IntegerField(default=1)
+    pages = models.IntegerField(blank=True, null=True)
+    total = models.IntegerField(blank=True, null=True)
+    is_finished = models.BooleanField(default=False)
+
+    created_at = models.DateTimeField(auto_now=False, auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, auto_now_add=False)
+
+    class Meta:
+        verbose_name = _('Harvest cursor')
+        verbose_name_plural = _('Harvest cursors')
+        get_latest_by = 'updated_at'
+        ordering = ['-updated_at']
+
+    def __str__(self):
+        return '{}: page {} of {}'.format(self.search, self.next_page, self.pages)
+
+
+class Candidate(models.Model):
+    """
+    A Flickr photo harvested for a search and not triaged yet.
+    """
+
+    search = models.ForeignKey(Search, on_delete=models.CASCADE, related_name='candidates')
+    photo_id = models.CharField(max_length=255)
+    position = models.IntegerField()
+
+    title = models.CharField(max_length=255, blank=True, null=True)
+    owner = models.CharField(max_length=255)
+    secret = models.CharField(max_length=255)
+    server = models.CharField(max_length=255)
+    farm = models.IntegerField()
+
+    license = models.CharField(max_length=2, choices=settings.FLICKR_LICENSES, blank=True, null=True)
+    tags = models.TextField(blank=True, null=True)
+
+    ispublic = models.NullBooleanField()
+    isfriend = models.NullBooleanField()
+    isfamily = models.NullBooleanField()
+
+    created_at = models.DateTimeField(auto_now=False, auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('Candidate')
+        verbose_name_plural = _('Candidates')
+        ordering = ['search', 'position']
+        unique_together = ('search', 'photo_id')
+        index_together = ('search', 'position')
+
+    def __str__(self):
+        return '{}'.format(self.photo_id)
+
+    def as_photo(self):
+        """
+        Return the candidate in the shape of a `flickr.photos.search` photo.
+        """
+        return {
+            'id': self.photo_id,
+            'owner': self.owner,
+            'secret': self.secret,
+            'server': self.server,
+            'farm': self.farm,
+            'title': self.title,
+            'ispublic': int(bool(self.ispublic)),
+            'isfriend': int(bool(self.isfriend)),
+            'isfamily': int(bool(self.isfamily)),
+            'license': self.license,
+            'tags': self.tags,
+        }
+
+
+class MirroredThumbnail(models.Model):
+    """
+    The name of a thumbnail the image mirror made of the photo at `url`
+    with `options`, so it can be served after the photo was evicted from
+    the mirror or removed from Flickr.
+    """
+
+    url = models.CharField(max_length=255)
+    options = models.CharField(max_length=255)
+    name = models.CharField(max_length=255)
+
+    created_at = models.DateTimeField(auto_now=False, auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('Mirrored thumbnail')
+        verbose_name_plural = _('Mirrored thumbnails')
+        unique_together = ('url', 'options')
+
+    def __str__(self):
+        return self.name
+
 
 class SemanticCheck(models.Model):
 
@@ -123,6 +412,11 @@ class Annotation(models.Model):
         verbose_name_plural = _('Annotations')
         get_latest_by = 'updated_at'
         ordering = ['-is_approved', '-created_at', '-updated_at',]
+        indexes = [
+            models.Index(fields=['created_at'], name='flickr_annotation_created_idx'),
+            models.Index(fields=['-is_approved', '-created_at', '-updated_at'],
+                name='flickr_annotation_ordering_idx'),
+        ]
 
     def __str__(self):
         return 'Annotation for image: {}'.format(self.image)
@@ -138,6 +432,9 @@ class AnnotationSemanticCheck(models.Model):
         verbose_name_plural = _('Annotation semantic checks')
         ordering = ['-value']
         unique_together = ('annotation', 'semantic_check')
+        indexes = [
+            models.Index(fields=['annotation', '-value'], name='flickr_asc_value_idx'),
+        ]
 
     def __str__(self):
         return '{}::{}'.format(self.semantic_check.label, self.value)
@@ -192,14 +489,87 @@ class MarkedObject(models.Model):
             self.OBJECT_TYPES[self.object_type][1], self.x, self.y, self.width, self.height)
 
 
+def delete_orphan_images(image_ids=None):
+    """
+    Delete selected images that belong to no search and have no annotation,
+    optionally limited to `image_ids`.
+    """
+    orphans = Image.objects.filter(search=None, annotation=None)
+    if image_ids is not None:
+        orphans = orphans.filter(id__in=image_ids)
+    return orphans.delete()
+
+
+@receiver(pre_delete, sender=Search)
+def collect_search_images(sender, instance, **kwargs):
+    # The through rows are gone by post_delete, so remember the images here.
+    if settings.SEARCH_ORPHAN_CLEANUP == 'immediate':
+        instance._image_ids = list(instance.images.values_list('id', flat=True))
+
+
 @receiver(post_delete, sender=Search)
 def clean_search_images(sender, instance, **kwargs):
-    for image in Image.objects.all():
-        if image.search.count() == 0 and image.annotation_set.count() == 0:
-            image.delete()
+    image_ids = getattr(instance, '_image_ids', None)
+    if image_ids:
+        delete_orphan_images(image_ids)
+
+
+@receiver(m2m_changed, sender=Search.images.through)
+def count_search_images(sender, instance, action, reverse, pk_set, **kwargs):
+    # Images linked outside the triage ingest, e.g. from the admin widget,
+    # adjust the selected counters here. Removals are counted from the rows
+    # that actually exist, as `pk_set` lists every image that was asked for.
+    if action in ('pre_remove', 'pre_clear'):
+        links = sender.objects.filter(**{'image' if reverse else 'search': instance})
+        if pk_set is not None:
+            links = links.filter(**{'search__in' if reverse else 'image__in': pk_set})
+        instance._unlinked_search_ids = list(links.values_list('search_id', flat=True))
+        return
+    if action == 'post_add':
+        search_ids = list(pk_set) if reverse else [instance.pk] * len(pk_set)
+        step = 1
+    elif action in ('post_remove', 'post_clear'):
+        search_ids = instance.__dict__.pop('_unlinked_search_ids', [])
+        step = -1
+    else:
+        return
+    counts = {}
+    for search_id in search_ids:
+        counts[search_id] = counts.get(search_id, 0) + step
+    for (search_id, count) in counts.items():
+        Search.objects.filter(pk=search_id).update(selected_count=F('selected_count') + count)
+    if counts:
+        invalidate_namespace('searches')
+        invalidate_facets()
+
+
+@receiver(post_save, sender=Search)
+def index_search_tags(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and 'tags' not in update_fields:
+        return
+    names = split_tags(instance.tags, ',')
+    if not created:
+        instance.search_tags.exclude(tag__name__in=names).delete()
+    link_tags(SearchTag, 'search', {instance.pk: names})
 
 
 @receiver(post_delete, sender=Annotation)
 def clean_annotation_images(sender, instance, **kwargs):
     if instance.paint_image:
         instance.paint_image.delete(False)
+
+
+@receiver([post_save, post_delete], sender=Annotation)
+@receiver(m2m_changed, sender=Annotation.marked_objects.through)
+def invalidate_annotation_facets(sender, **kwargs):
+    invalidate_facets()
+
+
+@receiver([post_save, post_delete], sender=Search)
+def invalidate_search_list(sender, **kwargs):
+    invalidate_namespace('searches')
+
+
+@receiver([post_save, post_delete], sender=SemanticCheck)
+def invalidate_semantic_check_list(sender, **kwargs):
+    invalidate_namespace('semantic-checks')
@@ -0,0 +1,166 @@
+import json
+from collections import OrderedDict
+from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
+from django.db import connections
+from django.utils import six
+from django.utils.functional import cached_property
+from django.utils.translation import ugettext_lazy as _
+from rest_framework.pagination import BasePagination, PageNumberPagination, \
+    CursorPagination, _positive_int
+
+
+def estimate_count(queryset):
+    """
+    Return the planner's row estimate for `queryset` on PostgreSQL, and
+    the exact count elsewhere.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    (sql, params) = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) {}'.format(sql), params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, six.string_types):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that skips the COUNT(*) query. Page numbers beyond the
+    estimate are still served, so an estimate that is too low never
+    hides rows.
+    """
+
+    @cached_property
+    def count(self):
+        return estimate_count(self.object_list)
+
+    def validate_number(self, number):
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(_('That page number is not an integer'))
+        if number < 1:
+            raise EmptyPage(_('That page number is less than 1'))
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        return self._get_page(self.object_list[bottom:bottom + self.per_page], number, self)
+
+
+class CountingPageNumberPagination(PageNumberPagination):
+    """
+    Page number pagination where `?count=estimate` replaces the exact
+    COUNT(*) with the query planner's estimate.
+    """
+
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if request.query_params.get(self.count_query_param) == 'estimate':
+            self.django_paginator_class = EstimatedCountPaginator
+        return super(CountingPageNumberPagination, self).paginate_queryset(queryset, request, view)
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination over `ordering`, with a client-selectable page size.
+    Pages cost an indexed range scan however deep they are, and no count
+    is computed.
+    """
+
+    ordering = '-created_at'
+    page_size_query_param = 'page_size'
+    max_page_size = None
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def _get_position_from_instance(self, instance, ordering):
+        field_name = ordering[0].lstrip('-')
+        if isinstance(instance, dict):
+            return six.text_type(instance[field_name])
+        return six.text_type(getattr(instance, field_name))
+
+
+class HybridPagination(BasePagination):
+    """
+    Page number pagination by default, keyset pagination over the view's
+    `ordering` when the request carries a `cursor` or asks for
+    `pagination=cursor`. Views without an `ordering` are always paginated
+    by page number.
+    """
+
+    page_size = None
+    page_size_query_param = 'page_size'
+    max_page_size = None
+
+    def get_ordering(self, view):
+        return getattr(view, 'ordering', None)
+
+    def use_keyset(self, request, view=None):
+        return self.get_ordering(view) is not None and (
+            KeysetPagination.cursor_query_param in request.query_params
+            or request.query_params.get('pagination') == 'cursor')
+
+    def get_paginator(self, request=None, view=None):
+        if request is not None and self.use_keyset(request, view):
+            paginator = KeysetPagination()
+            paginator.ordering = self.get_ordering(view)
+        else:
+            paginator = CountingPageNumberPagination()
+        paginator.page_size = self.page_size
+        paginator.page_size_query_param = self.page_size_query_param
+        paginator.max_page_size = self.max_page_size
+        return paginator
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.paginator = self.get_paginator(request, view)
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    @property
+    def display_page_controls(self):
+        return getattr(self.paginator, 'display_page_controls', False)
+
+    def to_html(self):
+        return self.paginator.to_html()
+
+    def get_results(self, data):
+        return data['results']
+
+    def get_schema_fields(self, view):
+        fields = OrderedDict()
+        paginators = [CountingPageNumberPagination()]
+        if self.get_ordering(view) is not None:
+            paginators.append(KeysetPagination())
+        for paginator in paginators:
+            paginator.page_size_query_param = self.page_size_query_param
+            for field in paginator.get_schema_fields(view):
+                fields[field.name] = field
+        return list(fields.values())
+
+
+class LargeResultsSetPagination(HybridPagination):
+    page_size = 1000
+    page_size_query_param = 'page_size'
+    max_page_size = 10000
+
+
+class StandardResultsSetPagination(HybridPagination):
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
@@ -0,0 +1,21 @@
+from rest_framework.parsers import FileUploadParser
+
+
+class ImageUploadParser(FileUploadParser):
+    """
+    Parses a raw image request body into `request.data['file']`.
+
+    The body goes through Django's upload handlers, so large images are
+    spooled to a temporary file in chunks. A filename in the
+    `Content-Disposition` header is optional.
+    """
+
+    media_type = 'image/*'
+    default_filename = 'upload'
+
+    def get_filename(self, stream, media_type, parser_context):
+        filename = super(ImageUploadParser, self).get_filename(stream, media_type, parser_context)
+        if filename:
+            return filename
+        subtype = media_type.partition('/')[2].partition(';')[0].strip()
+        return '{}.{}'.format(self.default_filename, subtype or 'png')
@@ -0,0 +1,155 @@
+import hashlib
+import logging
+from abc import ABCMeta, abstractmethod
+from django.conf import settings
+from redis.exceptions import RedisError
+from .connections import get_redis
+from .models import Image, DiscardedImage
+
+
+logger = logging.getLogger(__name__)
+
+
+def triaged_image_ids():
+    """
+    Iterate over the ids of every selected and discarded image.
+    """
+    for model in (Image, DiscardedImage):
+        for image_id in model.objects.values_list('id', flat=True).iterator():
+            yield image_id
+
+
+class SeenImageIndex(metaclass=ABCMeta):
+    """
+    Bloom filter over the ids of selected and discarded images.
+
+    A negative answer is definite, so only probable positives need to be
+    checked against Postgres. Bits are laid out the way Redis SETBIT/GETBIT
+    address them, which lets a bitmap built in memory be stored as-is.
+    """
+
+    def __init__(self, bits=None, hashes=None):
+        self.bits = bits or settings.SEEN_INDEX_BITS
+        self.hashes = hashes or settings.SEEN_INDEX_HASHES
+
+    def offsets(self, image_id):
+        digest = hashlib.md5(str(image_id).encode('utf-8')).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:], 'big') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def build_bitmap(self, image_ids):
+        bitmap = bytearray(self.bits // 8 + 1)
+        for image_id in image_ids:
+            for offset in self.offsets(image_id):
+                bitmap[offset >> 3] |= 0x80 >> (offset & 7)
+        return bitmap
+
+    @abstractmethod
+    def probable_ids(self, image_ids):
+        """
+        Return the subset of `image_ids` that may already be triaged.
+        """
+
+    @abstractmethod
+    def add(self, image_ids):
+        pass
+
+    @abstractmethod
+    def rebuild(self):
+        pass
+
+
+class UnindexedSeenImages(SeenImageIndex):
+    """
+    Stand-in used when REDIS_URL is not set.
+
+    A per-process bitmap would miss images triaged by the other worker
+    processes until rebuilt, and rebuilding scans both image tables, so
+    without Redis every id is reported as a probable positive and the
+    database lookup decides.
+    """
+
+    def probable_ids(self, image_ids):
+        return set(image_ids)
+
+    def add(self, image_ids):
+        pass
+
+    def rebuild(self):
+        pass
+
+
+class RedisSeenImageIndex(SeenImageIndex):
+    """
+    Index stored as a Redis bitmap and shared by every worker.
+
+    Until the first rebuild marks it ready, the index reports every id as
+    a probable positive, and Redis errors fall back to the same
+    behaviour, so a missing index only costs the database lookup it was
+    meant to save. New ids are always added to the bitmap, so none are
+    lost while a rebuild scans the database.
+    """
+
+    def __init__(self, connection, key=None, *args, **kwargs):
+        super(RedisSeenImageIndex, self).__init__(*args, **kwargs)
+        self.connection = connection
+        self.key = key or settings.SEEN_INDEX_KEY
+        self.ready_key = '{}:ready'.format(self.key)
+        self.rebuild_key = '{}:rebuild'.format(self.key)
+
+    def probable_ids(self, image_ids):
+        image_ids = list(image_ids)
+        try:
+            pipe = self.connection.pipeline(transaction=False)
+            pipe.exists(self.ready_key)
+            for image_id in image_ids:
+                for offset in self.offsets(image_id):
+                    pipe.getbit(self.key, offset)
+            results = pipe.execute()
+        except RedisError:
+            logger.exception('Seen image index lookup failed')
+            return set(image_ids)
+
+        if not results[0]:
+            return set(image_ids)
+        bits = results[1:]
+        return set(image_id for (i, image_id) in enumerate(image_ids)
+            if all(bits[i * self.hashes:(i + 1) * self.hashes]))
+
+    def add(self, image_ids):
+        try:
+            pipe = self.connection.pipeline(transaction=False)
+            for image_id in image_ids:
+                for offset in self.offsets(image_id):
+                    pipe.setbit(self.key, offset, 1)
+            pipe.execute()
+        except RedisError:
+            logger.exception('Seen image index update failed')
+
+    def rebuild(self):
+        """
+        Build the bitmap from the database under a temporary key and OR it
+        into the live one, which keeps the ids added during the scan. Bits
+        of deleted images stay set; they only cost a database lookup.
+        """
+        self.connection.set(self.rebuild_key, bytes(self.build_bitmap(triaged_image_ids())))
+        pipe = self.connection.pipeline()
+        pipe.bitop('OR', self.key, self.key, self.rebuild_key)
+        pipe.delete(self.rebuild_key)
+        pipe.set(self.ready_key, 1)
+        pipe.execute()
+
+
+_index = None
+
+
+def get_seen_index():
+    global _index
+    if _index is None:
+        connection = get_redis()
+        if connection is not None:
+            _index = RedisSeenImageIndex(connection)
+        else:
+            _index = UnindexedSeenImages()
+    return _index
@@ -1,14 +1,21 @@
-import requests
 from django.conf import settings
+from django.urls import reverse
 from django.utils.translation import ugettext_lazy as _
-from rest_framework import serializers, permissions, response
+from rest_framework import serializers
 from drf_extra_fields.fields import Base64ImageField
 from .models import (
     Search, Image, DiscardedImage,
     Annotation,
     SemanticCheck, AnnotationSemanticCheck,
-    MarkedObject
+    MarkedObject, Tag,
+    get_cached_image_url,
 )
+from .ingest import ingest_triaged_images
+from .masks import compact_mask
+
+
+IMAGE_LIST_FIELDS = ('id', 'secret', 'title', 'owner', 'server', 'farm',
+    'license', 'tags', 'ispublic', 'isfriend', 'isfamily')
 
 
 class ImageSerializer(serializers.ModelSerializer):
@@ -17,8 +24,8 @@ class ImageSerializer(serializers.ModelSerializer):
         (1, _('Discarded')),
     )
     state = serializers.ChoiceField(choices=STATES, default=0)
-    flickr_url = serializers.ReadOnlyField(source='get_flickr_url')
-    flickr_thumbnail = serializers.ReadOnlyField(source='get_flickr_thumbnail')
+    flickr_url = serializers.SerializerMethodField()
+    flickr_thumbnail = serializers.SerializerMethodField()
 
     class Meta:
         model = Image
@@ -31,45 +38,128 @@ class ImageSerializer(serializers.ModelSerializer):
             'state')
         read_only_fields = ('flickr_thumbnail', 'flickr_url')
 
+    def get_flickr_url(self, obj):
+        return obj.get_cached_image_url(request=self.context.get('request'))
+
+    def get_flickr_thumbnail(self, obj):
+        return obj.get_cached_image_url(size='thumbnail', request=self.context.get('request'))
+
+
+LICENSE_VALUES = {str(value): value for (value, label) in settings.FLICKR_LICENSES}
+
+
+def image_row_data(row, base_url=None):
+    """
+    Represent an `Image.objects.values(*IMAGE_LIST_FIELDS)` row the way
+    `ImageSerializer` represents an instance, without per-field overhead.
+    `base_url` is the `get_mirror_base_url` of the request.
+    """
+    photo = (row['farm'], row['server'], row['id'], row['secret'])
+    data = {field: row[field] for field in IMAGE_LIST_FIELDS}
+    data['license'] = LICENSE_VALUES.get(row['license'], row['license'])
+    data['flickr_url'] = get_cached_image_url(*photo, base_url=base_url)
+    data['flickr_thumbnail'] = get_cached_image_url(*photo, size='thumbnail', base_url=base_url)
+    data['state'] = 0
+    return data
+
+
+class TriagedImageListSerializer(serializers.ListSerializer):
+    """
+    Checks the secrets of a whole triage submission with one query per
+    table, in place of the per-row uniqueness validator.
+    """
+
+    def validate(self, images):
+        errors = []
+        for (model, state) in ((Image, 0), (DiscardedImage, 1)):
+            ids_by_secret = {}
+            for image in images:
+                if image.get('state', 0) != state:
+                    continue
+                if ids_by_secret.setdefault(image['secret'], image['id']) != image['id']:
+                    errors.append(_('Images {} and {} have the same secret.').format(
+                        ids_by_secret[image['secret']], image['id']))
+            errors.extend(_('The secret of image {} belongs to image {}.').format(
+                ids_by_secret[secret], image_id)
+                for (image_id, secret) in model.objects.filter(
+                    secret__in=list(ids_by_secret)).values_list('id', 'secret')
+                if ids_by_secret[secret] != image_id)
+        if errors:
+            raise serializers.ValidationError(errors)
+        return images
+
+
+class TriagedImageSerializer(ImageSerializer):
+    """
+    Validates triage submissions without per-row uniqueness queries.
+    Images that already exist are skipped by the bulk ingest, and
+    secrets are checked for the whole submission.
+    """
+
+    class Meta(ImageSerializer.Meta):
+        list_serializer_class = TriagedImageListSerializer
+        extra_kwargs = {
+            'id': {'validators': []},
+            'secret': {'validators': []},
+        }
+
 
 class SearchSerializer(serializers.ModelSerializer):
+    """
+    A search with its triage counters and a link to its paginated
+    selected images. Images are accepted on write, stored like a triage
+    submission, but not listed.
+    """
 
     licenses = serializers.MultipleChoiceField(choices=settings.FLICKR_LICENSES, allow_blank=True)
     tag_mode = serializers.ChoiceField(choices=Search.TAG_MODES, allow_blank=False, default=Search.TAG_MODES[0])
-    images = ImageSerializer(many=True)
+    images = TriagedImageSerializer(many=True, write_only=True, required=False)
+    remaining_count = serializers.IntegerField(read_only=True)
+    images_url = serializers.SerializerMethodField()
 
     class Meta:
         model = Search
-        fields = ('id', 'tags', 'tag_mode', 'user_id', 'licenses', 'images')
-        read_only_fields = ('created_at', 'updated_at')
-        depth = 1
+        fields = ('id', 'tags', 'tag_mode', 'user_id', 'licenses', 'images',
+            'selected_count', 'discarded_count', 'flickr_total', 'remaining_count', 'images_url')
+        read_only_fields = ('created_at', 'updated_at', 'selected_count', 'discarded_count', 'flickr_total')
+
+    def get_images_url(self, obj):
+        url = reverse('search-images', kwargs={'pk': obj.pk})
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
 
     def create(self, validated_data):
-        images_data = validated_data.pop('images')
+        images_data = validated_data.pop('images', [])
         (instance, created) = Search.objects.get_or_create(**validated_data)
-        for image_data in images_data:
-            state = image_data.get('state')
-            if state == 0:
-                (image, created) = instance.images.get_or_create(**image_data)
-            elif state == 1:
-                (discarded, created) = DiscardedImage.objects.get_or_create(**image_data)
-                # if image not in instance.images.all():
-                #     instance.images.add(image)
+        if images_data:
+            ingest_triaged_images(instance, images_data)
         return instance
 
     def update(self, instance, validated_data):
-        images_data = validated_data.pop('images')
-        for image_data in images_data:
-            state = image_data.get('state')
-            if state == 0:
-                (image, created) = Image.objects.get_or_create(**image_data)
-            elif state == 1:
-                (discarded, created) = DiscardedImage.objects.get_or_create(**image_data)
-                # image not in instance.images.all():
-                #     instance.images.add(image)
+        images_data = validated_data.pop('images', [])
+        if images_data:
+            ingest_triaged_images(instance, images_data)
         return instance
 
 
+class SearchWithImagesSerializer(SearchSerializer):
+    """
+    `SearchSerializer` that also embeds every selected image, for clients
+    that opt in with `embed_images`.
+    """
+
+    images = ImageSerializer(many=True, read_only=True)
+
+
+class TagSerializer(serializers.ModelSerializer):
+
+    image_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Tag
+        fields = ('id', 'name', 'image_count')
+
+
 class SemanticCheckSerializer(serializers.ModelSerializer):
 
     class Meta:
@@ -84,10 +174,19 @@ class AnnotationSemanticCheckSerializer(serializers.ModelSerializer):
         exclude = []
 
 
+class SemanticCheckValueSerializer(serializers.Serializer):
+    """
+    A semantic check value submitted for an annotation.
+    """
+
+    semantic_check = serializers.IntegerField()
+    value = serializers.FloatField(default=0.0)
+
+
 class MarkedObjectSerializer(serializers.ModelSerializer):
 
-    gender = serializers.ChoiceField(choices=MarkedObject.GENDERS, required=False)
-    age_group = serializers.ChoiceField(choices=MarkedObject.AGE_GROUPS, required=False)
+    gender = serializers.ChoiceField(choices=MarkedObject.GENDERS, required=False, allow_null=True)
+    age_group = serializers.ChoiceField(choices=MarkedObject.AGE_GROUPS, required=False, allow_null=True)
     uuid = serializers.UUIDField(required=False)
 
     class Meta:
@@ -95,7 +194,16 @@ class MarkedObjectSerializer(serializers.ModelSerializer):
         exclude = []
 
 
-class AnnotationSerializer(serializers.ModelSerializer):
+class CompactPaintImageMixin(object):
+    """
+    Stores submitted paint images re-encoded as palettized PNGs.
+    """
+
+    def validate_paint_image(self, value):
+        return compact_mask(value) if value else value
+
+
+class AnnotationSerializer(CompactPaintImageMixin, serializers.ModelSerializer):
 
     paint_image = Base64ImageField(required=False)
     image_url = serializers.SerializerMethodField(required=False)
@@ -107,4 +215,24 @@ class AnnotationSerializer(serializers.ModelSerializer):
         fields = ('id', 'image', 'paint_image', 'image_url', 'semantic_checks', 'marked_objects')
 
     def get_image_url(self, obj):
-        return obj.image.get_flickr_url
+        return obj.image.get_cached_image_url(request=self.context.get('request'))
+
+
+class BatchAnnotationSerializer(CompactPaintImageMixin, serializers.Serializer):
+    """
+    One annotation of a batch submission. Image and semantic check ids
+    are checked for the whole batch at once by the view.
+    """
+
+    image = serializers.CharField(max_length=255)
+    paint_image = Base64ImageField(required=False)
+    marked_objects = MarkedObjectSerializer(many=True, required=False)
+    semantic_checks = SemanticCheckValueSerializer(many=True, required=False)
+
+
+class PaintImageSerializer(CompactPaintImageMixin, serializers.Serializer):
+    """
+    A paint image sent as an uploaded file rather than a base64 string.
+    """
+
+    paint_image = serializers.ImageField()
@@ -0,0 +1,103 @@
+import io
+import json
+import os
+import tarfile
+import time
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from .client import FlickrClient
+from .export import annotation_rows, export_queryset
+
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def shard_ranges(annotations, shard_count):
+    """
+    Split `annotations` into at most `shard_count` contiguous primary key
+    ranges of about the same size. Returns `(first_pk, last_pk, count)`
+    tuples, taking one query per shard boundary.
+    """
+    pks = annotations.order_by('pk').values_list('pk', flat=True)
+    total = pks.count()
+    shard_count = max(min(shard_count, total), 1)
+    ranges = []
+    for index in range(shard_count):
+        start = total * index // shard_count
+        end = total * (index + 1) // shard_count
+        if end > start:
+            ranges.append((pks[start], pks[end - 1], end - start))
+    return ranges
+
+
+def shard_name(index):
+    return 'shard-{:05d}'.format(index)
+
+
+def read_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path) as manifest:
+        return json.load(manifest)
+
+
+def write_manifest(output_dir, manifest):
+    """
+    Replace the manifest atomically, so an interrupted export never
+    leaves a truncated one behind.
+    """
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(path + '.tmp', 'w') as output:
+        json.dump(manifest, output, indent=2, cls=DjangoJSONEncoder)
+    os.replace(path + '.tmp', path)
+
+
+def _add_member(archive, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = time.time()
+    offset = archive.offset + len(info.tobuf(archive.format, archive.encoding, archive.errors))
+    archive.addfile(info, io.BytesIO(data))
+    return [offset, info.size]
+
+
+def pack_shard(output_dir, index, first_pk, last_pk, is_approved=True):
+    """
+    Write the annotations with primary keys from `first_pk` to `last_pk`
+    to a webdataset style tar archive.
+
+    Every sample is keyed by annotation id and holds the Flickr photo
+    (`.jpg`), the paint mask (`.mask.png`) when there is one and the
+    labels (`.json`). The archive is written under a temporary name and
+    renamed when complete, next to an index of each sample's member
+    offsets. Samples whose photo can't be downloaded are skipped and
+    listed in the index. Returns the shard's manifest entry.
+    """
+    annotations = export_queryset(is_approved=is_approved).filter(pk__gte=first_pk, pk__lte=last_pk)
+    client = FlickrClient()
+    name = shard_name(index)
+    tar_path = os.path.join(output_dir, name + '.tar')
+    samples = []
+    skipped = []
+    with tarfile.open(tar_path + '.partial', 'w') as archive:
+        for row in annotation_rows(annotations, media_urls=False):
+            key = '{:09d}'.format(row['id'])
+            photo = client.download(row['image_url'])
+            if photo is None:
+                skipped.append(row['id'])
+                continue
+            members = {'jpg': _add_member(archive, key + '.jpg', photo)}
+            if row['paint_image']:
+                with default_storage.open(row['paint_image'], 'rb') as mask:
+                    members['mask.png'] = _add_member(archive, key + '.mask.png', mask.read())
+                row['paint_image'] = key + '.mask.png'
+            members['json'] = _add_member(archive, key + '.json',
+                json.dumps(row, cls=DjangoJSONEncoder).encode('utf-8'))
+            samples.append({'key': key, 'annotation': row['id'], 'image': row['image'], 'members': members})
+
+    with open(os.path.join(output_dir, name + '.index.json'), 'w') as output:
+        json.dump({'shard': name, 'first_pk': first_pk, 'last_pk': last_pk,
+            'samples': samples, 'skipped': skipped}, output)
+    os.replace(tar_path + '.partial', tar_path)
+    return {'samples': len(samples), 'skipped': len(skipped), 'tar': name + '.tar'}
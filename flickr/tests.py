@@ -1,3 +1,431 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer, ThreadingHTTPServer, BaseHTTPRequestHandler
+from unittest import mock
+from PIL import Image as PILImage, ImageDraw
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from fat.custom_storages import SpoolingMediaStorage
+from .client import FlickrClient
+from .ingest import ingest_triaged_images
+from .masks import compact_mask
+from .models import Search, Image, DiscardedImage, Annotation, SemanticCheck, AnnotationSemanticCheck, MarkedObject
+from .serializers import SearchSerializer
+from .shards import pack_shard, read_manifest, write_manifest
 
-# Create your tests here.
+
+class AnnotationQueryCountTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('annotator'))
+        self.semantic_checks = [SemanticCheck.objects.create(label=label) for label in ('a', 'b')]
+
+    def create_annotations(self, count):
+        for i in range(Annotation.objects.count(), Annotation.objects.count() + count):
+            image = Image.objects.create(id=str(i), secret='secret-{}'.format(i),
+                owner='owner', server='1', farm=1)
+            annotation = Annotation.objects.create(image=image)
+            for semantic_check in self.semantic_checks:
+                AnnotationSemanticCheck.objects.create(
+                    annotation=annotation, semantic_check=semantic_check, value=0.5)
+            for object_type in (0, 1):
+                annotation.marked_objects.add(MarkedObject.objects.create(
+                    object_type=object_type, x=0, y=0, width=10, height=10))
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_list_query_count_is_constant(self):
+        self.create_annotations(2)
+        small_page = self.count_queries('/api/v1/annotations')
+        self.create_annotations(20)
+        self.assertEqual(self.count_queries('/api/v1/annotations'), small_page)
+
+    def test_retrieve_prefetches_relations(self):
+        self.create_annotations(1)
+        annotation = Annotation.objects.get()
+        # Annotation with its image, marked objects and semantic checks.
+        self.assertEqual(self.count_queries('/api/v1/annotations/{}'.format(annotation.pk)), 3)
+
+
+class PhotoHandler(BaseHTTPRequestHandler):
+    """
+    Serves every photo path as its own bytes, except the photos whose
+    secret is `gone`.
+    """
+
+    def do_GET(self):
+        self.server.requested.append(self.path)
+        if self.path.endswith('_gone.jpg'):
+            self.send_error(404)
+            return
+        body = self.path.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FlickrHandler(BaseHTTPRequestHandler):
+    """
+    Answers the Flickr API over keep-alive connections, failing with 503
+    while the server has `failures` left and stalling on `/slow`.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requested.append((self.path, self.client_address))
+        if self.path == '/slow':
+            time.sleep(2)
+        if self.server.failures:
+            self.server.failures -= 1
+            self.respond(503, b'')
+        else:
+            self.respond(200, json.dumps({'stat': 'ok'}).encode('utf-8'))
+
+    def respond(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FlickrClientTests(TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FlickrHandler)
+        self.server.requested = []
+        self.server.failures = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+        self.flickr = FlickrClient(api_url=self.url + '/rest', api_key='key', api_secret='secret',
+            timeout=(1, 0.2), max_retries=2, backoff_factor=0)
+
+    def test_retries_server_errors(self):
+        self.server.failures = 2
+        self.assertEqual(self.flickr.call('flickr.test.echo'), {'stat': 'ok'})
+        self.assertEqual(len(self.server.requested), 3)
+
+    def test_gives_up_after_max_retries(self):
+        self.server.failures = 5
+        with self.assertLogs('flickr.client'):
+            self.assertIsNone(self.flickr.call('flickr.test.echo'))
+        self.assertEqual(len(self.server.requested), 3)
+
+    def test_times_out(self):
+        started = time.monotonic()
+        with self.assertLogs('flickr.client'):
+            self.assertIsNone(self.flickr.download(self.url + '/slow'))
+        self.assertLess(time.monotonic() - started, 2)
+
+    def test_reuses_the_connection(self):
+        for _ in range(3):
+            self.assertIsNotNone(self.flickr.call('flickr.test.echo'))
+        self.assertEqual(len({address for (path, address) in self.server.requested}), 1)
+
+
+class ShardExportTests(TransactionTestCase):
+    """
+    Packs shards from a fake photo server and filesystem storage. Data is
+    committed, so the forked workers of `export_shards` can read it.
+    """
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), PhotoHandler)
+        self.server.requested = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output_dir)
+        settings_override = override_settings(
+            DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+            MEDIA_ROOT=media_root,
+            FLICKR_IMAGE_URL='http://127.0.0.1:{}/{{farm}}/{{server}}/{{id}}_{{secret}}'.format(
+                self.server.server_port))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def create_annotation(self, id, secret=None, mask=None, is_approved=True):
+        image = Image.objects.create(id=id, secret=secret or 'secret-{}'.format(id),
+            owner='owner', server='1', farm=1)
+        annotation = Annotation.objects.create(image=image, is_approved=is_approved)
+        if mask is not None:
+            annotation.paint_image = default_storage.save('paint_image/{}.png'.format(id), ContentFile(mask))
+            annotation.save()
+        return annotation
+
+    def photo_path(self, id):
+        return '/1/1/{0}_secret-{0}.jpg'.format(id)
+
+    def test_pack_shard(self):
+        masked = self.create_annotation('1', mask=b'mask')
+        plain = self.create_annotation('2')
+        gone = self.create_annotation('3', secret='gone')
+        self.create_annotation('4', is_approved=False)
+
+        entry = pack_shard(self.output_dir, 0, masked.pk, gone.pk)
+        self.assertEqual(entry, {'samples': 2, 'skipped': 1, 'tar': 'shard-00000.tar'})
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir, 'shard-00000.tar.partial')))
+
+        masked_key = '{:09d}'.format(masked.pk)
+        plain_key = '{:09d}'.format(plain.pk)
+        tar_path = os.path.join(self.output_dir, 'shard-00000.tar')
+        with tarfile.open(tar_path) as archive:
+            self.assertEqual(archive.getnames(), [
+                masked_key + '.jpg', masked_key + '.mask.png', masked_key + '.json',
+                plain_key + '.jpg', plain_key + '.json'])
+            labels = json.loads(archive.extractfile(masked_key + '.json').read().decode('utf-8'))
+        self.assertEqual(labels['image'], '1')
+        self.assertEqual(labels['paint_image'], masked_key + '.mask.png')
+
+        with open(os.path.join(self.output_dir, 'shard-00000.index.json')) as index_file:
+            index = json.load(index_file)
+        self.assertEqual(index['skipped'], [gone.pk])
+        self.assertEqual([sample['annotation'] for sample in index['samples']], [masked.pk, plain.pk])
+        expected = {
+            (masked_key, 'jpg'): self.photo_path('1').encode('utf-8'),
+            (masked_key, 'mask.png'): b'mask',
+            (plain_key, 'jpg'): self.photo_path('2').encode('utf-8'),
+        }
+        with open(tar_path, 'rb') as archive:
+            for sample in index['samples']:
+                for (extension, (offset, size)) in sample['members'].items():
+                    if (sample['key'], extension) in expected:
+                        archive.seek(offset)
+                        self.assertEqual(archive.read(size), expected[(sample['key'], extension)])
+
+    def test_manifest_and_resume(self):
+        annotations = [self.create_annotation(str(i)) for i in range(4)]
+        call_command('export_shards', self.output_dir, shards=2, workers=1, stdout=io.StringIO())
+
+        manifest = read_manifest(self.output_dir)
+        self.assertTrue(manifest['is_approved'])
+        self.assertEqual([(shard['name'], shard['first_pk'], shard['last_pk'], shard['annotations'],
+            shard['samples'], shard['done']) for shard in manifest['shards']], [
+                ('shard-00000', annotations[0].pk, annotations[1].pk, 2, 2, True),
+                ('shard-00001', annotations[2].pk, annotations[3].pk, 2, 2, True)])
+
+        # A run interrupted while packing the second shard.
+        manifest['shards'][1]['done'] = False
+        write_manifest(self.output_dir, manifest)
+        os.remove(os.path.join(self.output_dir, 'shard-00001.tar'))
+        self.server.requested = []
+        call_command('export_shards', self.output_dir, shards=2, workers=1, stdout=io.StringIO())
+
+        self.assertEqual(sorted(self.server.requested), [self.photo_path('2'), self.photo_path('3')])
+        self.assertTrue(all(shard['done'] for shard in read_manifest(self.output_dir)['shards']))
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, 'shard-00001.tar')))
+
+
+class SpoolingMediaStorageTests(TestCase):
+    """
+    Spools to one temporary directory and uploads to a FileSystemStorage
+    in another, with an upload pool the tests can wait on.
+    """
+
+    def setUp(self):
+        self.spool_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.spool_root)
+        self.remote_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.remote_root)
+        settings_override = override_settings(
+            DEFAULT_FILE_STORAGE='fat.custom_storages.SpoolingMediaStorage',
+            MEDIA_REMOTE_STORAGE='django.core.files.storage.FileSystemStorage',
+            MEDIA_ROOT=self.remote_root,
+            MEDIA_URL='/media/',
+            MEDIA_SPOOL_ROOT=self.spool_root,
+            MEDIA_SPOOL_RETRIES=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        pool_patch = mock.patch('fat.custom_storages.get_upload_pool', return_value=self.pool)
+        pool_patch.start()
+        self.addCleanup(pool_patch.stop)
+
+    def wait_for_uploads(self):
+        self.pool.shutdown(wait=True)
+
+    def test_save_spools_then_uploads(self):
+        # Keep the upload queued until the spooled file is checked.
+        with mock.patch.object(self.pool, 'submit') as submit:
+            name = default_storage.save('paint_image/mask.png', ContentFile(b'mask'))
+        self.assertRegex(name, r'^paint_image/mask_[0-9a-f]{32}\.png$')
+        self.assertTrue(default_storage.is_spooled(name))
+        self.assertFalse(default_storage.remote.exists(name))
+        url = default_storage.url(name)
+        self.assertTrue(url.startswith('/spool/{}?signature='.format(name)))
+        with default_storage.open(name) as spooled:
+            self.assertEqual(spooled.read(), b'mask')
+
+        self.pool.submit(*submit.call_args[0])
+        self.wait_for_uploads()
+        self.assertFalse(default_storage.is_spooled(name))
+        with default_storage.remote.open(name) as uploaded:
+            self.assertEqual(uploaded.read(), b'mask')
+        self.assertEqual(default_storage.url(name), '/media/' + name)
+
+    def test_names_are_unique_without_the_remote_storage(self):
+        with mock.patch.object(self.pool, 'submit'), \
+                mock.patch.object(default_storage.remote, 'exists') as remote_exists:
+            names = set(default_storage.save('paint_image/mask.png', ContentFile(b'mask')) for i in range(3))
+        self.assertEqual(len(names), 3)
+        remote_exists.assert_not_called()
+
+    def test_spool_urls_are_signed(self):
+        with mock.patch.object(self.pool, 'submit'):
+            name = default_storage.save('paint_image/mask.png', ContentFile(b'mask'))
+        response = self.client.get(default_storage.url(name))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'mask')
+        self.assertEqual(self.client.get('/spool/' + name).status_code, 404)
+        self.assertEqual(self.client.get('/spool/{}?signature=forged'.format(name)).status_code, 404)
+
+    def test_files_spooled_elsewhere_redirect_to_the_remote_storage(self):
+        name = 'paint_image/elsewhere.png'
+        response = self.client.get('/spool/{}?signature={}'.format(name, default_storage.signature(name)))
+        self.assertRedirects(response, '/media/' + name, fetch_redirect_response=False)
+
+
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('annotator'))
+        now = timezone.now()
+        for i in range(5):
+            image = Image.objects.create(id=str(i), secret='secret-{}'.format(i),
+                owner='owner', server='1', farm=1)
+            annotation = Annotation.objects.create(image=image)
+            created_at = now - timezone.timedelta(minutes=i)
+            Image.objects.filter(pk=image.pk).update(created_at=created_at)
+            Annotation.objects.filter(pk=annotation.pk).update(created_at=created_at)
+
+    def walk(self, url):
+        ids = []
+        while url is not None:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            ids.extend(str(item['id']) for item in response.data['results'])
+            url = response.data['next']
+        return ids
+
+    def test_image_list(self):
+        self.assertEqual(self.walk('/api/v1/images?pagination=cursor&page_size=2'), ['0', '1', '2', '3', '4'])
+
+    def test_annotation_list(self):
+        expected = [str(pk) for pk in Annotation.objects.order_by('-created_at').values_list('pk', flat=True)]
+        self.assertEqual(self.walk('/api/v1/annotations?pagination=cursor&page_size=2'), expected)
+
+    def test_views_without_ordering_use_page_numbers(self):
+        SemanticCheck.objects.create(label='a')
+        for url in ('/api/v1/semantic-checks?pagination=cursor', '/api/v1/tags?cursor=abc'):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('count', response.data)
+
+
+class SearchCounterTests(TestCase):
+
+    def photo(self, id, state=0):
+        return {'id': str(id), 'secret': 'secret-{}'.format(id), 'title': 'title',
+            'owner': 'owner', 'server': '1', 'farm': 1, 'license': 0,
+            'tags': 'cat dog', 'ispublic': True, 'isfriend': False, 'isfamily': False,
+            'state': state}
+
+    def assertCounts(self, search, selected, discarded):
+        search.refresh_from_db()
+        self.assertEqual((search.selected_count, search.discarded_count), (selected, discarded))
+        self.assertEqual(search.images.count(), selected)
+
+    def test_ingest(self):
+        search = Search.objects.create(tags='cat', licenses=['0'])
+        ingest_triaged_images(search, [self.photo(1), self.photo(2), self.photo(3, state=1)])
+        self.assertCounts(search, 2, 1)
+
+    def test_serializer_create_and_update(self):
+        serializer = SearchSerializer(data={'tags': 'cat', 'licenses': ['0'],
+            'images': [self.photo(1), self.photo(2, state=1)]})
+        serializer.is_valid(raise_exception=True)
+        search = serializer.save()
+        self.assertCounts(search, 1, 1)
+        self.assertTrue(Image.objects.get(pk='1').image_tags.exists())
+
+        serializer = SearchSerializer(search, data={'tags': 'cat', 'licenses': ['0'],
+            'images': [self.photo(3), self.photo(4, state=1)]})
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        self.assertCounts(search, 2, 2)
+
+    def test_linking_images_directly(self):
+        search = Search.objects.create(tags='cat', licenses=['0'])
+        other = Search.objects.create(tags='dog', licenses=['0'])
+        images = [Image.objects.create(id=str(i), secret='secret-{}'.format(i),
+            owner='owner', server='1', farm=1) for i in range(3)]
+
+        # What the admin widget does when the selection changes.
+        search.images.set(images[:2])
+        self.assertCounts(search, 2, 0)
+        search.images.set(images[1:])
+        self.assertCounts(search, 2, 0)
+        search.images.remove(images[0])
+        self.assertCounts(search, 2, 0)
+
+        images[1].search.add(other)
+        self.assertCounts(other, 1, 0)
+        images[1].search.clear()
+        self.assertCounts(search, 1, 0)
+        self.assertCounts(other, 0, 0)
+        search.images.clear()
+        self.assertCounts(search, 0, 0)
+
+
+class CompactMaskTests(TestCase):
+
+    def test_transparent_mask_round_trip(self):
+        mask = PILImage.new('RGBA', (640, 480))
+        draw = ImageDraw.Draw(mask)
+        draw.ellipse((10, 10, 300, 200), fill=(255, 0, 0, 128))
+        draw.rectangle((320, 240, 600, 470), fill=(0, 0, 255, 200))
+        upload = io.BytesIO()
+        mask.save(upload, format='PNG')
+
+        stored = compact_mask(SimpleUploadedFile('mask.png', upload.getvalue()))
+        self.assertLess(stored.size, len(upload.getvalue()))
+        image = PILImage.open(io.BytesIO(stored.read()))
+        self.assertEqual(image.mode, 'P')
+        self.assertEqual(list(image.convert('RGBA').getdata()), list(mask.getdata()))
@@ -1,4 +1,8 @@
 from django.conf.urls import url, include
+from . import views
 
 
-urlpatterns = ()
+urlpatterns = [
+    url(r'^mirror/(?P<size>original|thumbnail)/(?P<farm>\d+)/(?P<server>\w+)/(?P<id>\d+)_(?P<secret>\w+)\.jpg$',
+        views.mirrored_image, name='mirrored-image'),
+]
@@ -1,25 +1,46 @@
-import requests
 import json
+from concurrent.futures import ThreadPoolExecutor
 from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.core.exceptions import ObjectDoesNotExist
 from django.shortcuts import redirect, get_object_or_404
 from django.urls import reverse
+from django.db import transaction
 from django.db.models import Count, Q
 from django.views.generic.base import TemplateView
 from django.utils.translation import ugettext_lazy as _
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse, FileResponse, Http404
+from django.views.decorators.cache import cache_control
+from django.views.static import serve
 from django_filters import rest_framework as filters
 from rest_framework import viewsets, parsers, views, mixins, permissions
 from rest_framework.response import Response
 from rest_framework.decorators import api_view
-from rest_framework.pagination import PageNumberPagination
 from rest_framework.decorators import list_route, detail_route
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from fat.custom_storages import SpoolingMediaStorage
 from .models import Search, Image, DiscardedImage, Annotation, SemanticCheck, \
-    AnnotationSemanticCheck, MarkedObject
-from .serializers import SearchSerializer, ImageSerializer, AnnotationSerializer, \
-    SemanticCheckSerializer, AnnotationSemanticCheckSerializer, MarkedObjectSerializer
+    AnnotationSemanticCheck, Tag, get_flickr_image_base, get_mirror_base_url, \
+    check_mirror_signature, split_tags
+from .serializers import SearchSerializer, SearchWithImagesSerializer, ImageSerializer, \
+    AnnotationSerializer, SemanticCheckSerializer, AnnotationSemanticCheckSerializer, MarkedObjectSerializer, \
+    TriagedImageSerializer, SemanticCheckValueSerializer, BatchAnnotationSerializer, \
+    PaintImageSerializer, TagSerializer, IMAGE_LIST_FIELDS, image_row_data
+from .annotations import create_annotations, update_annotation, replace_paint_image
+from .cache import namespace_key, invalidate_namespace
+from .client import get_client
+from .export import EXPORT_FORMATS, export_queryset
+from .facets import get_facets
+from .harvest import enqueue_harvest, get_harvested_images
+from .ingest import ingest_triaged_images
+from .masks import decode_mask, mask_to_rle
+from .mirror import get_image_mirror
+from .pagination import LargeResultsSetPagination, StandardResultsSetPagination
+from .parsers import ImageUploadParser
+from .seen import get_seen_index
 
 
 
@@ -32,6 +53,24 @@ class HomeView(TemplateView):
         return context
 
 
+class CachedListMixin(object):
+    """
+    Cache the list responses of a viewset under `cache_namespace`, one
+    entry per URL so every page and filter is cached separately. Writes
+    invalidate them through `invalidate_namespace`.
+    """
+
+    cache_namespace = None
+
+    def list(self, request, *args, **kwargs):
+        key = namespace_key(self.cache_namespace, request.build_absolute_uri())
+        data = cache.get(key)
+        if data is None:
+            data = super(CachedListMixin, self).list(request, *args, **kwargs).data
+            cache.set(key, data, settings.VIEW_CACHE_TIMEOUT)
+        return Response(data)
+
+
 def make_search_query(request, flickr_page=0):
 
     req_data = request.GET if request.method == 'GET' else request.data
@@ -51,35 +90,81 @@ def make_search_query(request, flickr_page=0):
         })
 
     tags = tags.replace(' ', '')
-    req = requests.get('https://api.flickr.com/services/rest/?method=flickr.photos.search',
-        params={
-            'api_key': settings.FLICKR_API_KEY,
-            'api_secret': settings.FLICKR_API_SECRET,
-            'format': 'json',
-            'nojsoncallback': 1,
-            'license': licenses,
-            'safe_search': 3,
-            'sort' : 'relevance',
-            'media': 'photos',
-            'content_type': 7,
-            'extras': 'license,tags',
-            'per_page': flickr_perpage,
-            'page': str(flickr_page),
-            'tags': tags,
-            'tag_mode': tag_mode})
-    if req.json()['stat'] == 'ok':
-        return req.json()
-    return None
+    return get_client().search(tags, tag_mode=tag_mode, licenses=licenses,
+        page=flickr_page, per_page=flickr_perpage)
+
+
+def get_untriaged_images(photos, limit):
+    """
+    Return up to `limit` photos that are not yet selected or discarded.
+
+    Photos are first checked against the seen image index, and only its
+    probable positives are looked up, with a single `id__in` query per
+    table for the whole Flickr page.
+    """
+    photo_ids = get_seen_index().probable_ids(photo.get('id') for photo in photos)
+    triaged_ids = set()
+    if photo_ids:
+        triaged_ids.update(Image.objects.filter(
+            id__in=photo_ids).values_list('id', flat=True))
+        triaged_ids.update(DiscardedImage.objects.filter(
+            id__in=photo_ids).values_list('id', flat=True))
+
+    untriaged_images = []
+    for photo in photos:
+        if len(untriaged_images) == limit:
+            break
+        if photo.get('id') not in triaged_ids:
+            untriaged_images.append(photo)
+    return untriaged_images
 
 
 def get_filtered_images(photos, cursor, perpage):
-    filtered_images = []
-    for image in photos:
-        existing_in_search = Image.objects.filter(id=image.get('id')).count()
-        existing_discarded = DiscardedImage.objects.filter(id=image.get('id')).count()
-        if existing_in_search + existing_discarded == 0:
-            filtered_images.append(image)
-    return filtered_images[cursor:cursor + perpage]
+    return get_untriaged_images(photos, cursor + perpage)[cursor:cursor + perpage]
+
+
+def prefetch_filtered_images(request, photos, flickr_page, flickr_pages, cursor, perpage):
+    """
+    Like `get_filtered_images`, but when `photos` doesn't hold enough
+    untriaged candidates the following Flickr pages are fetched
+    concurrently, `prefetch` pages at a time, until enough are collected,
+    the results run out or FLICKR_PREFETCH_MAX_PAGES pages were fetched.
+    """
+    req_data = request.GET if request.method == 'GET' else request.data
+    prefetch = min(int(req_data.get('prefetch', settings.FLICKR_PREFETCH_PAGES)),
+        settings.FLICKR_PREFETCH_MAX_PAGES)
+
+    wanted = cursor + perpage
+    candidates = get_untriaged_images(photos, wanted)
+    last_page = min(flickr_pages, flickr_page + settings.FLICKR_PREFETCH_MAX_PAGES)
+
+    while prefetch > 0 and len(candidates) < wanted and flickr_page < last_page:
+        pages = range(flickr_page + 1, min(flickr_page + prefetch, last_page) + 1)
+        with ThreadPoolExecutor(max_workers=len(pages)) as executor:
+            responses = list(executor.map(
+                lambda page: make_search_query(request, flickr_page=page), pages))
+
+        for json in responses:
+            if json is None or not json['photos']['photo']:
+                return candidates[cursor:wanted]
+            candidates.extend(get_untriaged_images(
+                json['photos']['photo'], wanted - len(candidates)))
+            if len(candidates) == wanted:
+                break
+        flickr_page = pages[-1]
+
+    return candidates[cursor:wanted]
+
+
+def search_data(request, search):
+    """
+    Represent `search` for the flickr endpoint. Its selected images are
+    only embedded when the client asks for them with `embed_images`.
+    """
+    req_data = request.GET if request.method == 'GET' else request.data
+    if str(req_data.get('embed_images', '')).lower() in ('1', 'true', 'yes'):
+        return SearchWithImagesSerializer(search, context={'request': request}).data
+    return SearchSerializer(search, context={'request': request}).data
 
 
 @api_view(['GET', 'POST', 'PUT'])
@@ -106,6 +191,23 @@ def flickr(request):
                 'user_id': user_id,
             }
         )
+
+        if settings.FLICKR_HARVEST_ENABLED:
+            if created:
+                enqueue_harvest(search)
+            harvested = get_harvested_images(search, req_cursor, req_perpage)
+            if harvested is not None:
+                (harvested_total, harvested_images) = harvested
+                return Response({
+                    'total': harvested_total,
+                    'left': search.remaining_count,
+                    'search': search_data(request, search),
+                    'images': harvested_images,
+                    'page': req_page,
+                    'perpage': req_perpage,
+                    'cursor': req_cursor,
+                })
+
         json = make_search_query(request)
 
         if json is None:
@@ -117,15 +219,19 @@ def flickr(request):
         flickr_total = int(results['total'])
         photos_results = results['photo']
 
-        search_serializer = SearchSerializer(search)
-        image_serializer = ImageSerializer(data=photos_results, many=True)
+        if search.flickr_total != flickr_total:
+            search.flickr_total = flickr_total
+            Search.objects.filter(pk=search.pk).update(flickr_total=flickr_total)
+            invalidate_namespace('searches')
+
+        search_payload = search_data(request, search)
 
         if flickr_total == 0:
 
             # check if all is already added
             return Response({
                 'total': 0,
-                'search': search_serializer.data,
+                'search': search_payload,
                 'images': [],
                 'page': req_page,
                 'perpage': req_perpage,
@@ -133,17 +239,15 @@ def flickr(request):
 
         else:
 
-            filtered_images = get_filtered_images(photos_results, req_cursor, req_perpage)
-            photos_result_ids = [p.get('id') for p in photos_results]
-
-            if len(photos_results) > 0:
+            filtered_images = prefetch_filtered_images(
+                request, photos_results, flickr_page, flickr_pages, req_cursor, req_perpage)
 
-                already_selected_count = search.images.filter(id__in=photos_result_ids).count()
+            if len(photos_results) > 0 or len(filtered_images) > 0:
 
                 return Response({
                     'total': flickr_total,
-                    'left': max(flickr_total - already_selected_count - search.images.count(), 0),
-                    'search': search_serializer.data,
+                    'left': search.remaining_count,
+                    'search': search_payload,
                     'images': filtered_images,
                     'page': req_page,
                     'perpage': req_perpage,
@@ -163,8 +267,8 @@ def flickr(request):
                     photos_results = results['photo']
                     return Response({
                         'total': flickr_total,
-                        'left': max(flickr_total - search.images.count(), 0),
-                        'search': search_serializer.data,
+                        'left': search.remaining_count,
+                        'search': search_payload,
                         'images': [],
                         'page': req_page,
                         'perpage': req_perpage,
@@ -174,7 +278,7 @@ def flickr(request):
                     return Response({
                         'total': flickr_total,
                         'left': 0,
-                        'search': search_serializer.data,
+                        'search': search_payload,
                         'images': [],
                         'page': req_page,
                         'perpage': req_perpage,
@@ -186,42 +290,68 @@ def flickr(request):
         if images_data is None:
             return Response({'message': _('Some images are required')})
 
-        (search, created) = Search.objects.get_or_create(
-            tags=request.data.get('tags'), defaults=request.data)
-        search_serializer = SearchSerializer(search)
-        search.save()
-
-        image_serializer = ImageSerializer(data=images_data, many=True)
-        if image_serializer.is_valid():
-            for image in image_serializer.validated_data:
-                state = image.pop('state')
-                if state == 0:
-                    (selected, created) = Image.objects.get_or_create(id=image.get('id'), defaults=image)
-                    if selected not in search.images.all():
-                        search.images.add(selected)
-                elif state == 1:
-                    (discarded, created) = DiscardedImage.objects.get_or_create(id=image.get('id'), defaults=image)
-            search.save()
-
-        search = Search.objects.get(tags=search.tags)
-        search_serializer = SearchSerializer(search)
+        image_serializer = TriagedImageSerializer(data=images_data, many=True)
+        if not image_serializer.is_valid():
+            return Response({'images': image_serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            (search, created) = Search.objects.get_or_create(
+                tags=tags,
+                defaults={
+                    'tag_mode': tag_mode,
+                    'licenses': licenses,
+                    'user_id': user_id,
+                }
+            )
+            ingest_triaged_images(search, image_serializer.validated_data)
+            search.save(update_fields=['updated_at'])
+
         return Response({
-            'search': search_serializer.data,
+            'search': search_data(request, search),
         })
 
     return Response({'message': _('GET, POST or PUT required.')}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
 
-class LargeResultsSetPagination(PageNumberPagination):
-    page_size = 1000
-    page_size_query_param = 'page_size'
-    max_page_size = 10000
-
-
-class StandardResultsSetPagination(PageNumberPagination):
-    page_size = 100
-    page_size_query_param = 'page_size'
-    max_page_size = 1000
+@cache_control(public=True, max_age=60 * 60 * 24 * 30)
+def mirrored_image(request, size, farm, server, id, secret):
+    """
+    Serve a Flickr photo or its thumbnail from the local image mirror,
+    fetching the photo on first access. Only the signed URLs of
+    `get_cached_image_url` are served.
+    """
+    path = '{}/{}/{}/{}_{}.jpg'.format(size, farm, server, id, secret)
+    if not check_mirror_signature(path, request.GET.get('signature', '')):
+        raise Http404
+    url = '{}.jpg'.format(get_flickr_image_base(farm, server, id, secret))
+    mirror = get_image_mirror()
+    if size == 'thumbnail':
+        # Served rather than redirected to: the thumbnail's storage URL
+        # can be a temporary spool URL, which mustn't be cached for long.
+        thumbnail = mirror.thumbnail(url)
+        if thumbnail is None:
+            raise Http404(_('The photo could not be fetched from Flickr.'))
+        return FileResponse(thumbnail.storage.open(thumbnail.name, 'rb'), content_type='image/jpeg')
+    path = mirror.fetch(url)
+    if path is None:
+        raise Http404(_('The photo could not be fetched from Flickr.'))
+    return FileResponse(open(path, 'rb'), content_type='image/jpeg')
+
+
+@cache_control(private=True)
+def spooled_media(request, path):
+    """
+    Serve media still waiting in this instance's upload spool. The URLs
+    are signed instead of authenticated, so the frontend's `<img>` tags
+    can load them. Files spooled by another instance are redirected to
+    the remote storage, which they reach once that instance uploads them.
+    """
+    if not isinstance(default_storage, SpoolingMediaStorage) or \
+            not default_storage.check_signature(path, request.GET.get('signature', '')):
+        raise Http404
+    if not default_storage.is_spooled(path):
+        return redirect(default_storage.remote.url(path))
+    return serve(request, path, document_root=default_storage.spool.location)
 
 
 class SearchQueryView(views.APIView):
@@ -234,20 +364,79 @@ class SearchQueryView(views.APIView):
         return Response(serializer.errors)
 
 
-class SearchViewSet(viewsets.ModelViewSet):
-
+def annotation_filters(request):
+    """
+    Parse the `?is_approved=` and `?search=` annotation filters of the
+    request into a boolean and a `Search`, each None when not given.
+    """
+    is_approved = request.query_params.get('is_approved')
+    if is_approved is not None:
+        is_approved = is_approved.lower() in ('1', 'true', 'yes')
+    search = request.query_params.get('search')
+    if search is not None:
+        if not search.isdigit():
+            raise ValidationError({'search': [_('A search id is required.')]})
+        search = get_object_or_404(Search, pk=search)
+    return (is_approved, search)
+
+
+class FacetsView(views.APIView):
+    """
+    Top tag and license counts of selected and discarded images and the
+    marked object histograms, optionally for one `?search=` and for
+    approved or unapproved annotations (`?is_approved=`). `?top=` sets
+    how many tags are counted, up to 100.
+    """
+
+    def get(self, request, format=None):
+        (is_approved, search) = annotation_filters(request)
+        top = request.query_params.get('top', '')
+        top = min(int(top), 100) if top.isdigit() and int(top) > 0 else None
+        return Response(get_facets(search=search, is_approved=is_approved, top=top))
+
+
+def filter_tags(queryset, request, link='image_tags'):
+    """
+    Narrow `queryset` to the rows carrying every `?tag=` of the request,
+    with one join on the tag index per tag.
+    """
+    for tag in request.query_params.getlist('tag'):
+        for name in split_tags(tag):
+            queryset = queryset.filter(**{'{}__tag__name'.format(link): name})
+    return queryset
+
+
+class SearchViewSet(CachedListMixin, viewsets.ModelViewSet):
+
+    cache_namespace = 'searches'
     serializer_class = SearchSerializer
     queryset = Search.objects.all()
     filter_backends = (filters.DjangoFilterBackend,)
     filter_fields = ('tags',)
     pagination_class = LargeResultsSetPagination
+    ordering = '-created_at'
 
     def get_queryset(self):
         queryset = Search.objects.all()
         query = self.request.query_params.get('q', None)
         if query is not None:
             queryset = queryset.filter(tags__icontains=query)
-        return queryset
+        return filter_tags(queryset, self.request, link='search_tags')
+
+    @detail_route(methods=['get'])
+    def images(self, request, pk=None):
+        """
+        Page through the images selected for this search, optionally only
+        those with every `?tag=`.
+        """
+        search = get_object_or_404(Search, pk=pk)
+        rows = filter_tags(search.images.all(), request).order_by('-created_at') \
+            .values(*IMAGE_LIST_FIELDS + ('created_at',))
+        base_url = get_mirror_base_url(request)
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response([image_row_data(row, base_url) for row in page])
+        return Response([image_row_data(row, base_url) for row in rows])
 
 
 
@@ -256,11 +445,26 @@ class ImageViewSet(viewsets.ModelViewSet):
     queryset = Image.objects.all()
     serializer_class = ImageSerializer
     pagination_class = LargeResultsSetPagination
+    ordering = '-created_at'
 
     def get_queryset(self):
+        queryset = Image.objects.all()
+        if self.action in ('list', 'retrieve'):
+            queryset = queryset.only(*IMAGE_LIST_FIELDS)
         if 'annotated_only' in self.request.query_params:
-            return Image.objects.filter(Q(annotation__exact=None) or Q(annotation__is_approved=False))
-        return Image.objects.all()
+            queryset = queryset.filter(
+                Q(annotation__exact=None) | Q(annotation__is_approved=False)).distinct()
+        return filter_tags(queryset, self.request)
+
+    def list(self, request, *args, **kwargs):
+        # Pages can hold 10,000 images, so rows are read with values() and
+        # represented by image_row_data instead of the model serializer.
+        queryset = self.filter_queryset(self.get_queryset()).values(*IMAGE_LIST_FIELDS + ('created_at',))
+        base_url = get_mirror_base_url(request)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response([image_row_data(row, base_url) for row in page])
+        return Response([image_row_data(row, base_url) for row in queryset])
 
 
 class AnnotationViewSet(viewsets.ModelViewSet):
@@ -268,9 +472,15 @@ class AnnotationViewSet(viewsets.ModelViewSet):
     queryset = Annotation.objects.all()
     serializer_class = AnnotationSerializer
     pagination_class = StandardResultsSetPagination
+    ordering = '-created_at'
+
+    def get_queryset(self):
+        return Annotation.objects \
+            .select_related('image') \
+            .prefetch_related('marked_objects', 'semantic_checks')
 
     def retrieve(self, request, pk=None):
-        annotation = get_object_or_404(self.queryset, pk=pk)
+        annotation = get_object_or_404(self.get_queryset(), pk=pk)
         serializer = self.get_serializer(annotation)
         return Response(serializer.data)
 
@@ -284,31 +494,180 @@ class AnnotationViewSet(viewsets.ModelViewSet):
     #         return Response(serializer.data, status=status.HTTP_201_CREATED)
     #     return Response(serializer.errors)
 
+    @list_route(methods=['post'])
+    def batch(self, request):
+        """
+        Create up to ANNOTATION_BATCH_MAX_SIZE annotations at once. Items
+        are validated together, the valid ones are written in one
+        transaction and the response lists a result per item, in request
+        order.
+        """
+        items = request.data.get('annotations') if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list):
+            return Response({'message': _('A list of annotations is required.')},
+                status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > settings.ANNOTATION_BATCH_MAX_SIZE:
+            return Response({'message': _('At most {} annotations can be sent at once.').format(
+                settings.ANNOTATION_BATCH_MAX_SIZE)}, status=status.HTTP_400_BAD_REQUEST)
+
+        serializers = [BatchAnnotationSerializer(data=item) for item in items]
+        valid = [serializer.is_valid() for serializer in serializers]
+
+        image_ids = set(serializer.validated_data['image']
+            for (serializer, is_valid) in zip(serializers, valid) if is_valid)
+        semantic_check_ids = set(data['semantic_check']
+            for (serializer, is_valid) in zip(serializers, valid) if is_valid
+            for data in serializer.validated_data.get('semantic_checks', []))
+        known_image_ids = set(Image.objects.filter(
+            pk__in=image_ids).values_list('pk', flat=True))
+        known_semantic_check_ids = set(SemanticCheck.objects.filter(
+            pk__in=semantic_check_ids).values_list('pk', flat=True))
+
+        results = []
+        accepted = []
+        for (index, (serializer, is_valid)) in enumerate(zip(serializers, valid)):
+            errors = dict(serializer.errors) if not is_valid else {}
+            if is_valid:
+                data = serializer.validated_data
+                if data['image'] not in known_image_ids:
+                    errors['image'] = [_('Unknown image.')]
+                unknown_ids = set(check['semantic_check']
+                    for check in data.get('semantic_checks', [])) - known_semantic_check_ids
+                if unknown_ids:
+                    errors['semantic_checks'] = [_('Unknown semantic checks: {}').format(
+                        ', '.join(str(pk) for pk in sorted(unknown_ids)))]
+            if errors:
+                results.append({'index': index, 'status': status.HTTP_400_BAD_REQUEST, 'errors': errors})
+            else:
+                results.append({'index': index, 'status': status.HTTP_201_CREATED})
+                accepted.append((results[-1], serializer.validated_data))
+
+        if accepted:
+            annotations = create_annotations([data for (result, data) in accepted])
+            created = self.get_queryset().in_bulk([annotation.pk for annotation in annotations])
+            for ((result, data), annotation) in zip(accepted, annotations):
+                result['annotation'] = self.get_serializer(created[annotation.pk]).data
+
+        if len(accepted) == len(results):
+            response_status = status.HTTP_201_CREATED
+        elif accepted:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response({'results': results}, status=response_status)
+
+    @detail_route(methods=['put'], url_path='paint_image',
+        parser_classes=(parsers.MultiPartParser, ImageUploadParser))
+    def upload_paint_image(self, request, pk=None):
+        """
+        Replace the paint image with a binary upload, either as the
+        `paint_image` part of a multipart form or as a raw `image/*` body.
+        """
+        annotation = get_object_or_404(Annotation, pk=pk)
+        serializer = PaintImageSerializer(data={
+            'paint_image': request.data.get('paint_image', request.data.get('file'))})
+        serializer.is_valid(raise_exception=True)
+        replace_paint_image(annotation, serializer.validated_data['paint_image'])
+
+        annotation_serializer = self.get_serializer(self.get_queryset().get(pk=annotation.pk))
+        return Response(annotation_serializer.data)
+
+    @detail_route(methods=['get'])
+    def mask(self, request, pk=None):
+        """
+        Decode the paint image back to an RGBA PNG, or to a COCO style
+        run-length encoding of the painted pixels with `?encoding=rle`.
+        """
+        annotation = get_object_or_404(Annotation, pk=pk)
+        if not annotation.paint_image:
+            return Response({'message': _('This annotation has no paint image.')},
+                status=status.HTTP_404_NOT_FOUND)
+        image = decode_mask(annotation.paint_image)
+        if request.query_params.get('encoding') == 'rle':
+            return Response(mask_to_rle(image))
+        response = HttpResponse(content_type='image/png')
+        image.save(response, format='PNG')
+        return response
+
+    @list_route(methods=['get'])
+    def export(self, request):
+        """
+        Stream annotations as `?type=coco`, `voc` or `jsonl`, optionally
+        filtered by `is_approved` and `search`.
+        """
+        export_format = request.query_params.get('type', 'jsonl')
+        if export_format not in EXPORT_FORMATS:
+            return Response({'type': [_('Choose one of: {}').format(', '.join(sorted(EXPORT_FORMATS)))]},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        (is_approved, search) = annotation_filters(request)
+
+        (exporter, content_type, extension) = EXPORT_FORMATS[export_format]
+        response = StreamingHttpResponse(
+            exporter(export_queryset(is_approved=is_approved, search=search)),
+            content_type=content_type)
+        response['Content-Disposition'] = 'attachment; filename="annotations.{}"'.format(extension)
+        return response
+
     def partial_update(self, request, pk=None):
-        if pk is not None:
-            annotation = Annotation.objects.get(pk=pk)
-
-            semantic_checks = request.data.get('semantic_checks')
-            if semantic_checks is not None:
-                AnnotationSemanticCheck.objects.filter(annotation=annotation).delete()
-                annotation_semantic_check_serializer = AnnotationSemanticCheckSerializer(
-                    data=semantic_checks, many=True)
-                if annotation_semantic_check_serializer.is_valid():
-                    annotation_semantic_check_serializer.save()
-
-            marked_objects = request.data.get('marked_objects')
-            if marked_objects is not None:
-                # marked_objects_serializer = MarkedObjectSerializer(data=marked_objects, many=True)
-                annotation.marked_objects.all().delete()
-                for data in marked_objects:
-                    marked_object = MarkedObject.objects.create(**data)
-                    annotation.marked_objects.add(marked_object)
-                annotation.save()
-            annotation_serializer = self.get_serializer(annotation)
-            return Response(annotation_serializer.data)
-
-
-class SemanticCheckViewSet(viewsets.ModelViewSet):
+        annotation = get_object_or_404(Annotation, pk=pk)
+
+        semantic_checks = request.data.get('semantic_checks')
+        if semantic_checks is not None:
+            semantic_check_serializer = SemanticCheckValueSerializer(data=semantic_checks, many=True)
+            semantic_check_serializer.is_valid(raise_exception=True)
+            semantic_checks = semantic_check_serializer.validated_data
+            semantic_check_ids = set(data['semantic_check'] for data in semantic_checks)
+            unknown_ids = semantic_check_ids - set(SemanticCheck.objects.filter(
+                pk__in=semantic_check_ids).values_list('pk', flat=True))
+            if unknown_ids:
+                return Response({'semantic_checks': [_('Unknown semantic checks: {}').format(
+                    ', '.join(str(pk) for pk in sorted(unknown_ids)))]}, status=status.HTTP_400_BAD_REQUEST)
+
+        marked_objects = request.data.get('marked_objects')
+        if marked_objects is not None:
+            marked_object_serializer = MarkedObjectSerializer(data=marked_objects, many=True)
+            marked_object_serializer.is_valid(raise_exception=True)
+            marked_objects = marked_object_serializer.validated_data
+
+        update_annotation(annotation,
+            marked_objects_data=marked_objects, semantic_checks_data=semantic_checks)
+
+        annotation_serializer = self.get_serializer(self.get_queryset().get(pk=annotation.pk))
+        return Response(annotation_serializer.data)
+
+
+class TagViewSet(CachedListMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Tags with the number of selected images carrying them, most used first.
+    `?q=` matches the start of tag names and `?search=` counts only the
+    images selected for that search. Lists are cached with the facet
+    counts, which triage invalidates.
+    """
+
+    cache_namespace = 'facets'
+    queryset = Tag.objects.all()
+    serializer_class = TagSerializer
+    pagination_class = StandardResultsSetPagination
+
+    def get_queryset(self):
+        queryset = Tag.objects.all()
+        query = self.request.query_params.get('q', None)
+        if query:
+            if settings.FORCE_LOWERCASE_TAGS:
+                query = query.lower()
+            queryset = queryset.filter(name__startswith=query)
+        search = self.request.query_params.get('search', None)
+        if search and search.isdigit():
+            queryset = queryset.filter(image_tags__image__search=search)
+        return queryset \
+            .annotate(image_count=Count('image_tags')) \
+            .order_by('-image_count', 'name')
+
+
+class SemanticCheckViewSet(CachedListMixin, viewsets.ModelViewSet):
+
+    cache_namespace = 'semantic-checks'
 
     queryset = SemanticCheck.objects.all()
     serializer_class = SemanticCheckSerializer